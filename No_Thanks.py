@@ -3,6 +3,10 @@ import numpy as np
 import pandas as pd
 import itertools
 
+from tracing import DEBUG, INFO, EventTracer, PrintSink, null_tracer
+
+tracer = null_tracer
+
 # 1. State, Action and Reward
 # ----------------------------------------------------------------------------
 
@@ -184,7 +188,8 @@ class MonteCarloAgent(object):
         # Update Q-values of all state-action pairs visited in the simulation
         for s,a in zip(self.state_seen, self.action_seen):
             self.q.loc[[s], a] += self.step_size * (reward - self.q.loc[[s], a])
-            print(self.q.loc[[s],a])
+            if tracer.level <= DEBUG:
+                tracer.emit(DEBUG, "q_update", state = s, action = a, q = self.q.loc[[s],a][0])
             
         self.state_seen, self.action_seen, self.q_seen = list(), list(), list()
         
@@ -280,14 +285,9 @@ class QLearningAgent(object):
             this_q = self.q.loc[[state], action][0]
             reward = self.R.loc[[state], action][0]
         
-            print("\n")
-            print(f'prev_q: {prev_q}')
-            print(f'this_q: {this_q}')
-            print(f'prev_state: {self.prev_state}')
-            print(f'this_state: {state}')
-            print(f'prev_action: {self.prev_action}')
-            print(f'this_action: {action}')
-            print(f'reward: {reward}')
+            if tracer.level <= DEBUG:
+                tracer.emit(DEBUG, "q_update", prev_q = prev_q, this_q = this_q, prev_state = self.prev_state, 
+                            this_state = state, prev_action = self.prev_action, this_action = action, reward = reward)
             
             # Calculate new Q-values
             if reward == 0:
@@ -320,7 +320,8 @@ class Deck(object):
         for card in deck:
             self.deck.append(card)
         
-        print("The deck has been shuffled.")
+        if tracer.level <= INFO:
+            tracer.emit(INFO, "shuffle", message = "The deck has been shuffled.")
             
     def draw(self):
         return self.deck.pop()
@@ -351,7 +352,8 @@ class Player(object):
         global card_pool
         
         card_pool = deck.draw()
-        print(f'{self.name} draws the number ' + str(card_pool) + ".")
+        if tracer.level <= INFO:
+            tracer.emit(INFO, "draw", player = self.name, card = card_pool, message = f'{self.name} draws the number ' + str(card_pool) + ".")
         
         player.rand_play(player, deck)
     
@@ -362,7 +364,9 @@ class Player(object):
         self.card_hand.append(card_pool)
         self.chip_hand += chip_pool
         
-        print(f'{self.name} takes the ' + str(card_pool) + " and " + str(chip_pool) + " chips.")
+        if tracer.level <= INFO:
+            tracer.emit(INFO, "take", player = self.name, card = card_pool, chips = chip_pool, 
+                        message = f'{self.name} takes the ' + str(card_pool) + " and " + str(chip_pool) + " chips.")
         
         chip_pool = 0
         
@@ -376,7 +380,8 @@ class Player(object):
         self.chip_hand -= 1
         chip_pool += 1
         
-        print(f'{self.name} passes the ' + str(card_pool) + " and loses a chip.")
+        if tracer.level <= INFO:
+            tracer.emit(INFO, "pass", player = self.name, card = card_pool, message = f'{self.name} passes the ' + str(card_pool) + " and loses a chip.")
         
     def identify_state(self):
     
@@ -487,19 +492,25 @@ def Run_Game(player_1, player_2, player_3, algo, agent_info):
         P2_total = Player_2.point_tally()
         P3_total = Player_3.point_tally()
         
-        print(f'{Player_1.name} has a final score of ' + str(P1_total))
-        print(f'{Player_2.name} has a final score of ' + str(P2_total))
-        print(f'{Player_3.name} has a final score of ' + str(P3_total))
+        for player, total in [(Player_1, P1_total), (Player_2, P2_total), (Player_3, P3_total)]:
+            if tracer.level <= INFO:
+                tracer.emit(INFO, "score", player = player.name, score = total, message = f'{player.name} has a final score of ' + str(total))
         
         if min(P1_total, P2_total, P3_total) == P1_total:
-            print(f'{Player_1.name} has won!!!')
+            winner = Player_1.name
             
         elif min(P1_total, P2_total, P3_total) == P2_total:
-             print(f'{Player_2.name} has won!!!')
+            winner = Player_2.name
          
         elif min(P1_total, P2_total, P3_total) == P3_total:
-             print(f'{Player_3.name} has won!!!')
+            winner = Player_3.name
+            
+        if tracer.level <= INFO:
+            tracer.emit(INFO, "winner", player = winner, message = f'{winner} has won!!!')
              
 agent_init_info = {"epsilon":0.2, "step_size":0.2, "new_model":True}
+
+# Narrate the single game on the terminal
+tracer = EventTracer(PrintSink(), level = INFO)
             
 Run_Game('Alice', 'Bob', 'Charlie', "q-learning", agent_init_info)  
\ No newline at end of file
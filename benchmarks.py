@@ -0,0 +1,230 @@
+import argparse
+import contextlib
+import gc
+import io
+import json
+import random
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from untitled4 import (StateSpace, StateEncoder, reward_matrix, new_agent,
+                       Tournament, GameEngine, abstractions, agent_init_info)
+
+# Benchmarks
+# ----------------------------------------------------------------------------
+#
+# Every benchmark returns a dict of metrics. A metric is a dict with its
+# value, its unit and whether "lower" or "higher" values are better, which
+# is what the comparison against a baseline goes by.
+
+def seed(value = 0):
+    random.seed(value)
+    np.random.seed(value)
+
+def timed(function, repeat):
+    """
+    Runs function repeat times and returns the best time in seconds together
+    with the peak memory of one run in bytes. Garbage collection is off while
+    the time is taken, like in timeit.
+    """
+
+    best = float("inf")
+    for i in range(repeat):
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            function()
+            best = min(best, time.perf_counter() - start)
+        finally:
+            gc.enable()
+
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return best, peak
+
+def metric(value, unit, better = "lower"):
+    return {"value": value, "unit": unit, "better": better}
+
+def bench_state_space(repeat):
+    """
+    Time and memory to enumerate the whole state space.
+    """
+
+    seconds, peak = timed(lambda: list(StateSpace()), repeat)
+
+    return {"state_space_build": metric(seconds, "s"),
+            "state_space_memory": metric(peak, "bytes")}
+
+def bench_rewards(repeat):
+    """
+    Time and memory to build the reward matrix over the encoder.
+    """
+
+    seconds, peak = timed(lambda: reward_matrix(StateEncoder()), repeat)
+
+    return {"reward_matrix_build": metric(seconds, "s"),
+            "reward_matrix_memory": metric(peak, "bytes")}
+
+def bench_agent(algo, calls, repeat, moves = 6):
+    """
+    Latency of single calls to step() and update() on states of the state
+    space, drawn at random with a fixed seed. The states are played in
+    episodes of moves steps like games: q-learning updates after every step,
+    Monte Carlo once at the end of an episode from all of its moves, so its
+    update latency is per episode. The best of repeat passes counts.
+    """
+
+    seed()
+    agent = new_agent(algo, agent_init_info)
+    space = list(StateSpace())
+    states = [space[i] for i in np.random.randint(len(space), size = calls)]
+    episodes = [states[i:i + moves] for i in range(0, calls, moves)]
+    actions_dict = {"take":1,"pass":1}
+    online = algo == "q-learning"
+
+    def play():
+        step = update = 0.0
+        for episode in episodes:
+            for state in episode:
+                start = time.perf_counter()
+                agent.step(state, actions_dict)
+                step += time.perf_counter() - start
+
+                if online:
+                    start = time.perf_counter()
+                    agent.update(state, "pass")
+                    update += time.perf_counter() - start
+
+            if online:
+                agent.agent_end(0)
+            else:
+                start = time.perf_counter()
+                agent.update(episode[-1], "pass")
+                update += time.perf_counter() - start
+
+        return step, update
+
+    gc.disable()
+    try:
+        times = [play() for i in range(repeat)]
+    finally:
+        gc.enable()
+
+    step = min(step for step, update in times) / calls
+    update = min(update for step, update in times) / (calls if online else len(episodes))
+
+    return {f'{algo}_step_latency': metric(step * 1e6, "us"),
+            f'{algo}_update_latency': metric(update * 1e6, "us")}
+
+def bench_tournament(algo, games):
+    """
+    Games per second of a whole Tournament, agent set-up included.
+    """
+
+    seed()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        Tournament('Alice', 'Bob', 'Charlie', games, algo, agent_init_info)
+    seconds = time.perf_counter() - start
+
+    return {f'{algo}_tournament_speed': metric(games / seconds, "games/s", "higher")}
+
+def bench_abstraction(games):
+    """
+    Rows of the table and win rate of a monte-carlo agent trained for games 
+    games with each state abstraction, next to the number of keys it has.
+    """
+    
+    results = dict()
+    
+    for name in abstractions:
+        seed()
+        agent = new_agent("monte-carlo", dict(agent_init_info, abstraction = name))
+        game = GameEngine(agent, "monte-carlo", config = agent.config)
+        wins = sum(game.play().winner == game.n_players - 1 for i in range(games))
+        
+        results[f'{name}_table_size'] = metric(len(agent.q), "rows")
+        results[f'{name}_keys'] = metric(len(agent.abstraction), "keys")
+        results[f'{name}_win_rate'] = metric(wins / games, "share", "higher")
+        
+    return results
+
+def run(repeat = 3, calls = 10000, games = 2000):
+    results = dict()
+    results.update(bench_state_space(repeat))
+    results.update(bench_rewards(repeat))
+
+    for algo in ["monte-carlo", "q-learning"]:
+        results.update(bench_agent(algo, calls, repeat))
+        results.update(bench_tournament(algo, games))
+        
+    results.update(bench_abstraction(games))
+
+    return results
+
+# Comparison
+# ----------------------------------------------------------------------------
+
+def compare(results, baseline, threshold):
+    """
+    Returns the metrics that got worse than the baseline by more than the
+    threshold, as a share of the baseline value.
+    """
+
+    regressions = dict()
+
+    for name, base in baseline.items():
+        if name not in results:
+            continue
+
+        value = results[name]["value"]
+        if base["better"] == "lower":
+            change = value / base["value"] - 1
+        else:
+            change = base["value"] / value - 1
+
+        if change > threshold:
+            regressions[name] = change
+
+    return regressions
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = "Benchmarks for the No Thanks! agents.")
+    parser.add_argument("--output", help = "write the results to this JSON file")
+    parser.add_argument("--baseline", help = "compare against the results in this JSON file")
+    parser.add_argument("--threshold", type = float, default = 0.2,
+                        help = "allowed slowdown against the baseline, e.g. 0.2 for 20%% (default)")
+    parser.add_argument("--repeat", type = int, default = 3)
+    parser.add_argument("--calls", type = int, default = 10000)
+    parser.add_argument("--games", type = int, default = 2000)
+    args = parser.parse_args(argv)
+
+    results = run(args.repeat, args.calls, args.games)
+
+    for name, result in results.items():
+        print(f'{name:32} {result["value"]:14.3f} {result["unit"]}')
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent = 2)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = compare(results, json.load(file), args.threshold)
+
+        for name, change in regressions.items():
+            print(f'Regression: {name} is {change:.0%} worse than the baseline.')
+
+        if regressions:
+            return 1
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
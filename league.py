@@ -0,0 +1,241 @@
+import os
+import random
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from untitled4 import (GameEngine, LinearQ, Policy, PolicyOpponent, SnapshotOpponent, RandomOpponent,
+                       ThresholdOpponent, RunOpponent, new_agent, play_round, worker_info)
+
+# Ratings
+# ----------------------------------------------------------------------------
+
+class Elo(object):
+    """
+    Elo ratings for games of more than two players. A game counts as a win of
+    its winner against every other player and as a draw between the others.
+    Ratings are updated after every round of games with the tally of wins per
+    seat, and a round counts like one rated game, so a round of many games
+    costs one update and ratings move by at most k per round:
+
+    R(i) = R(i) + k / (n - 1) * (S(i) - E(i))
+
+    with S(i) the points of seat i against all others per game of the round
+    and E(i) the points its rating predicted.
+    """
+
+    def __init__(self, k = 32, initial = 1500):
+        self.k = k
+        self.initial = initial
+        self.ratings = dict()
+        self.games = dict()
+
+    def add(self, name, rating = None):
+        self.ratings[name] = self.initial if rating is None else rating
+        self.games[name] = 0
+
+    def expected(self, a, b):
+        """
+        Probability that a beats b.
+        """
+
+        return 1 / (1 + 10 ** ((self.ratings[b] - self.ratings[a]) / 400))
+
+    def update(self, names, tally):
+        """
+        Updates the ratings of the players in names, one per seat, from the
+        wins per seat of a round. A player in several seats is rated once, on
+        the wins of all its seats.
+        """
+
+        players = list(dict.fromkeys(names))
+        tally = [sum(wins for name, wins in zip(names, tally) if name == player) for player in players]
+        names = players
+
+        n = len(names)
+        games = sum(tally)
+        delta = [0.0] * n
+
+        # A player alone in every seat has nobody to be rated against
+        for i, name in enumerate(names if n > 1 else []):
+            score = tally[i] * (n - 1) + (games - tally[i]) * 0.5 * (n - 2)
+            expected = sum(self.expected(name, other) for j, other in enumerate(names) if j != i)
+            delta[i] = self.k / (n - 1) * (score / games - expected)
+
+        for name, change in zip(names, delta):
+            self.ratings[name] += change
+            self.games[name] += games
+
+    def table(self):
+        """
+        Returns the ratings as a DataFrame, best first.
+        """
+
+        frame = pd.DataFrame({"rating": self.ratings, "games": self.games})
+
+        return frame.sort_values("rating", ascending = False)
+
+# League
+# ----------------------------------------------------------------------------
+
+class League(object):
+    """
+    Trains an agent against a pool of opponents that grows with frozen
+    snapshots of the agent itself. Games are played in rounds of round_games:
+    each opponent seat is given a member of the pool at random, the agent
+    learns from the games of the round, and the tally of the round updates
+    the Elo ratings of everyone who played. Every snapshot_every games the
+    greedy policy of the agent is frozen and joins the pool with the current
+    rating of the agent, so the agent keeps meeting stronger versions of
+    itself. Only the latest max_snapshots snapshots stay in the pool.
+
+    The pool starts with the heuristics, random, threshold and run-seeking
+    opponents by default. The opponents of a round are drawn without
+    replacement, so no member plays against itself.
+
+    Snapshots are frozen into a Policy with Policy.from_agent() while the
+    encoder of the game has at most Policy.max_states states, and into a
+    SnapshotOpponent for larger games. Both work for linear agents as well.
+    With path, every snapshot is also saved there, a Policy as <name>.npz
+    (see Policy.save()) and a larger snapshot as the table or weights of the
+    agent in the directory <name>.
+
+    With more than one worker, the games of a round are split between worker
+    processes like in parallel_tournament() and their changes to the table
+    are merged with merge_deltas(), which needs a tabular agent.
+
+    Required parameters:
+        - algo as str, see new_agent()
+        - agent_info as dict, see agent_init_info
+    """
+
+    def __init__(self, algo, agent_info, heuristics = None, snapshot_every = 10000, max_snapshots = 10,
+                 round_games = 1000, workers = 1, merge = "average", seed = 0, path = None, k = 32):
+        self.algo = algo
+        self.agent_info = agent_info
+        self.snapshot_every = snapshot_every
+        self.max_snapshots = max_snapshots
+        self.round_games = round_games
+        self.workers = workers
+        self.merge = merge
+        self.seed = seed
+        self.path = path
+
+        self.agent = new_agent(algo, agent_info)
+        self.config = self.agent.config
+        if workers > 1 and isinstance(self.agent.q, LinearQ):
+            raise ValueError(f'Leagues with more than one worker need a tabular agent, not "{algo}".')
+
+        self.rng = random.Random(seed)
+        self.elo = Elo(k)
+        self.elo.add("agent")
+
+        if heuristics is None:
+            heuristics = {"random": RandomOpponent(config = self.config),
+                          "threshold": ThresholdOpponent(config = self.config),
+                          "run": RunOpponent(config = self.config)}
+
+        self.members = dict()
+        self.snapshots = list()
+        for name, opponent in heuristics.items():
+            self.members[name] = opponent
+            self.elo.add(name)
+
+        self.played = 0
+        self.shard = 0
+
+    def snapshot(self):
+        """
+        Freezes the current greedy policy of the agent and adds it to the pool.
+        """
+
+        name = f'snapshot-{self.played}'
+
+        # A Policy holds a byte for every state, larger games are frozen lazily
+        if len(self.agent.encoder) <= Policy.max_states:
+            policy = Policy.from_agent(self.agent)
+            self.members[name] = PolicyOpponent(policy, self.config)
+        else:
+            policy = None
+            self.members[name] = SnapshotOpponent(self.agent, self.config)
+
+        self.elo.add(name, self.elo.ratings["agent"])
+        self.snapshots.append(name)
+
+        if self.path is not None:
+            os.makedirs(self.path, exist_ok = True)
+            if policy is not None:
+                policy.save(os.path.join(self.path, name + ".npz"))
+            else:
+                self.agent.q.save(os.path.join(self.path, name))
+
+        if len(self.snapshots) > self.max_snapshots:
+            del self.members[self.snapshots.pop(0)]
+
+        return name
+
+    def opponents(self):
+        """
+        Draws a member of the pool for every opponent seat, each member at
+        most once while the pool has enough of them.
+        """
+
+        members = list(self.members)
+        seats = self.config.players - 1
+
+        if len(members) >= seats:
+            return self.rng.sample(members, seats)
+
+        return [self.rng.choice(members) for i in range(seats)]
+
+    def play_round(self, names, games, pool = None):
+        """
+        Plays games with the pool members in names in the opponent seats and
+        returns the tally.
+        """
+
+        policies = [self.members[name] for name in names]
+
+        if pool is None:
+            game = GameEngine(self.agent, self.algo, policies, tracer = self.agent.tracer, config = self.config)
+            tally = [0] * game.n_players
+
+            for i in range(games):
+                tally[game.play().winner] += 1
+
+            return tally
+
+        tally, records = play_round(pool, self.algo, worker_info(self.agent_info), self.agent.q, games, self.workers,
+                                    self.seed + self.shard, policies, self.merge)
+        self.shard += min(self.workers, games)
+
+        return tally
+
+    def run(self, match_no):
+        """
+        Plays match_no games and returns the rating table.
+        """
+
+        pool = ProcessPoolExecutor(max_workers = self.workers) if self.workers > 1 else None
+        since_snapshot = 0
+
+        try:
+            start = self.played
+            while self.played - start < match_no:
+                games = min(self.round_games, match_no - (self.played - start))
+                names = self.opponents()
+
+                tally = self.play_round(names, games, pool)
+                self.elo.update(names + ["agent"], tally)
+
+                self.played += games
+                since_snapshot += games
+
+                if since_snapshot >= self.snapshot_every:
+                    self.snapshot()
+                    since_snapshot = 0
+        finally:
+            if pool is not None:
+                pool.shutdown()
+
+        return self.elo.table()
@@ -0,0 +1,138 @@
+import os
+
+import numpy as np
+
+# Game Records
+# ----------------------------------------------------------------------------
+#
+# Every game is kept as one record of a NumPy structured array. Records are
+# collected in preallocated buffers and written to disk in shards of plain
+# .npy files, which open again as memory maps, so a run of any length can be
+# analysed shard by shard without ever being read into memory as a whole.
+
+def result_dtype(n_players = 3):
+    """
+    Returns the record layout of one game with n_players players:
+
+        scores -> final points of every seat
+        winner -> seat of the winner
+        margin -> points of the winner ahead of the runner-up
+        cards  -> number of cards every seat has taken
+        chips  -> chips every seat has left
+        turns  -> number of turns of the game
+    """
+
+    return np.dtype([("scores", np.int16, (n_players,)), ("winner", np.int8), ("margin", np.int16),
+                     ("cards", np.int8, (n_players,)), ("chips", np.int16, (n_players,)), ("turns", np.int32)])
+
+class ResultBuffer(object):
+    """
+    Preallocated array for the records of up to size games.
+    """
+
+    def __init__(self, n_players = 3, size = 65536):
+        self.records = np.zeros(size, dtype = result_dtype(n_players))
+        self.n = 0
+
+    def __len__(self):
+        return self.n
+
+    def full(self):
+        return self.n == len(self.records)
+
+    def append(self, result):
+        """
+        Adds the GameResult of one game.
+        """
+
+        scores = result.scores
+        best = sorted(scores)[-2:]
+
+        self.records[self.n] = (scores, result.winner, best[1] - best[0], [bin(hand).count("1") for hand in result.hands],
+                                result.chips, result.turns)
+        self.n += 1
+
+    def view(self):
+        """
+        Returns the records added so far, without copying them.
+        """
+
+        return self.records[:self.n]
+
+    def clear(self):
+        self.n = 0
+
+class ResultWriter(object):
+    """
+    Streams game records to the directory path. Records are collected in a
+    ResultBuffer of buffer_size games and every full buffer is written as the
+    next shard, results-000000.npy, results-000001.npy, ... Call close() at
+    the end to write the rest. Memory stays at one buffer however many games
+    are recorded.
+
+    Required parameters:
+        - path as str, the directory of the shards
+    """
+
+    def __init__(self, path, n_players = 3, buffer_size = 65536):
+        self.path = path
+        self.buffer = ResultBuffer(n_players, buffer_size)
+        self.shards = len(shard_files(path)) if os.path.isdir(path) else 0
+
+        os.makedirs(path, exist_ok = True)
+
+    def write(self, result):
+        self.buffer.append(result)
+
+        if self.buffer.full():
+            self.flush()
+
+    def extend(self, records):
+        """
+        Adds records that were collected elsewhere, e.g. in a worker process.
+        """
+
+        buffer = self.buffer
+        while len(records):
+            n = min(len(records), len(buffer.records) - buffer.n)
+            buffer.records[buffer.n:buffer.n + n] = records[:n]
+            buffer.n += n
+            records = records[n:]
+
+            if buffer.full():
+                self.flush()
+
+    def flush(self):
+        if len(self.buffer):
+            file = os.path.join(self.path, f'results-{self.shards:06d}.npy')
+            with open(file + ".tmp", "wb") as f:
+                np.save(f, self.buffer.view())
+            os.replace(file + ".tmp", file)
+
+            self.shards += 1
+            self.buffer.clear()
+
+    def close(self):
+        self.flush()
+
+def shard_files(path):
+    return sorted(os.path.join(path, file) for file in os.listdir(path)
+                  if file.startswith("results-") and file.endswith(".npy"))
+
+def iter_results(path, mmap_mode = "r"):
+    """
+    Yields the shards written by a ResultWriter one at a time as memory-mapped
+    record arrays. Columns are read like results["scores"], which is a view
+    into the file as well.
+    """
+
+    for file in shard_files(path):
+        yield np.load(file, mmap_mode = mmap_mode)
+
+def load_results(path, mmap_mode = "r"):
+    """
+    Returns all shards written by a ResultWriter as a list of memory-mapped
+    record arrays.
+    """
+
+    return list(iter_results(path, mmap_mode))
@@ -0,0 +1,239 @@
+import numpy as np
+
+from untitled4 import GameConfig, QTable, actions
+
+# Vectorized Self-Play
+# ----------------------------------------------------------------------------
+
+class VectorSimulator(object):
+    """
+    Plays many games of No Thanks! at once. Every game is a row in a set of
+    NumPy arrays (deck, open card, chips on the card, chips and hand bitmask
+    of every player, seat to move), and step() advances all games by one turn
+    with a fixed number of array operations instead of a Python call per game.
+
+    The rules are the same as in GameEngine and the game is given by a
+    GameConfig, the default game otherwise: n_draw of the cards are dealt,
+    players start with their chips, a player takes the open card together
+    with its chips and draws the next one, or passes and puts a chip on it,
+    has to take when out of chips, and the game ends as soon as the deck is
+    empty after a move. The seats in front of the agent play like rand_play()
+    unless opponents are given, the agent sits in the last seat.
+
+    The agent is epsilon-greedy on a dense QTable over the index of the
+    encoder of the game, so the deck has to be small enough for one. When
+    a game ends, its state-action pairs are updated in one batch towards the
+    final score of the agent, counting each pair once per game:
+
+    q(s,a) = q(s,a) + (alpha) * (G - q(s,a))
+
+    Pairs visited by several games of the same batch are moved towards their
+    mean return with the combined step size 1 - (1 - alpha)^n.
+
+    Finished games are dealt again straight away, so every call to step()
+    keeps all n_games busy.
+
+    opponents takes one Opponent per seat in front of the agent. Each of them
+    decides for all games where its seat is up with a single call to act().
+
+    Required parameters:
+        - n_games as int, the number of games played side by side
+    """
+
+    def __init__(self, n_games, q = None, epsilon = 0.2, step_size = 0.2, learn = True, seed = None, config = None,
+                 opponents = None):
+        self.n_games = n_games
+        self.config = config if config is not None else GameConfig()
+        self.encoder = self.config.encoder()
+        self.q = q if q is not None else QTable(len(self.encoder), actions())
+        self.epsilon = epsilon
+        self.step_size = step_size
+        self.learn = learn
+        self.rng = np.random.default_rng(seed)
+        self.opponents = opponents
+
+        if not isinstance(self.q, QTable) or len(self.q.values) != len(self.encoder):
+            raise ValueError("The simulator needs a dense QTable with one row per state of the encoder.")
+
+        self.cards = np.array(self.config.cards)
+        self.n_players = self.config.players
+        self.n_draw = self.config.n_draw
+        self.agent_seat = self.n_players - 1
+
+        # An agent decides at most once per card taken and once per chip spent
+        self.max_steps = self.n_draw + self.config.chips * self.n_players + 1
+
+        self.deck = np.zeros((n_games, self.n_draw), dtype = np.int64)
+        self.top = np.zeros(n_games, dtype = np.int64)
+        self.card = np.zeros(n_games, dtype = np.int64)
+        self.pool = np.zeros(n_games, dtype = np.int64)
+        self.chips = np.zeros((n_games, self.n_players), dtype = np.int64)
+        self.hands = np.zeros((n_games, self.n_players), dtype = np.int64)
+        self.seat = np.zeros(n_games, dtype = np.int64)
+        self.turns = np.zeros(n_games, dtype = np.int64)
+
+        self.episode_states = np.zeros((n_games, self.max_steps), dtype = np.int64)
+        self.episode_actions = np.zeros((n_games, self.max_steps), dtype = np.int64)
+        self.episode_length = np.zeros(n_games, dtype = np.int64)
+
+        self.tally = np.zeros(self.n_players, dtype = np.int64)
+        self.games_played = 0
+        self.turns_played = 0
+
+        self.reset(np.arange(n_games))
+
+    def reset(self, games):
+        """
+        Deals a new game in the given rows.
+        """
+
+        n = len(games)
+        self.deck[games] = self.cards[np.argsort(self.rng.random((n, len(self.cards))), axis = 1)[:, :self.n_draw]]
+        self.card[games] = self.deck[games, 0]
+        self.top[games] = 1
+        self.pool[games] = 0
+        self.chips[games] = self.config.chips
+        self.hands[games] = 0
+        self.seat[games] = 0
+        self.turns[games] = 0
+        self.episode_length[games] = 0
+
+    def encode(self, games, seat = None):
+        """
+        Encodes the state of the given seat, the agent by default, in the
+        given rows, see StateEncoder.
+        """
+
+        seat = self.agent_seat if seat is None else seat
+
+        return self.encoder.encode_parts(-self.card[games], self.pool[games], self.chips[games, seat], self.hands[games, seat])
+
+    def agent_actions(self, states, can_pass):
+        """
+        Chooses epsilon-greedy actions for a batch of states, 0 to take and 1
+        to pass. Ties between the values are broken at random.
+        """
+
+        n = len(states)
+        values = self.q.values[states]
+        coin = self.rng.random(n) < 0.5
+
+        greedy = np.where(values[:, 1] == values[:, 0], coin, values[:, 1] > values[:, 0])
+        explore = self.rng.random(n) < self.epsilon
+
+        return (np.where(explore, coin, greedy) & can_pass).astype(np.int64)
+
+    def step(self):
+        """
+        Plays one turn in every game. Returns the rows of the games that ended
+        in this turn, before they are dealt again.
+        """
+
+        rows = np.arange(self.n_games)
+        seat_chips = self.chips[rows, self.seat]
+
+        # Opponents take on a coin flip or ask their plug-in, the agent picks
+        # from its table
+        take = self.rng.integers(0, 2, self.n_games) == 0
+
+        if self.opponents is not None:
+            for seat, opponent in enumerate(self.opponents):
+                games = np.flatnonzero(self.seat == seat)
+                if len(games):
+                    take[games] = opponent.act(self.encode(games, seat)) == 0
+
+        agent_games = np.flatnonzero(self.seat == self.agent_seat)
+        if len(agent_games):
+            states = self.encode(agent_games)
+            action = self.agent_actions(states, seat_chips[agent_games] > 0)
+            take[agent_games] = action == 0
+
+            length = self.episode_length[agent_games]
+            self.episode_states[agent_games, length] = states
+            self.episode_actions[agent_games, length] = action
+            self.episode_length[agent_games] += 1
+            np.add.at(self.q.visits, (states, action), 1)
+
+        take |= seat_chips == 0
+        done = self.top == self.n_draw
+
+        # Take: the card and its chips go to the player, who draws the next card
+        taker = np.flatnonzero(take)
+        self.hands[taker, self.seat[taker]] |= 1 << (self.card[taker] - self.encoder.low)
+        self.chips[taker, self.seat[taker]] += self.pool[taker]
+        self.pool[taker] = 0
+
+        draw = taker[~done[taker]]
+        self.card[draw] = self.deck[draw, self.top[draw]]
+        self.top[draw] += 1
+
+        # Pass: one chip goes on the card and the next player is up
+        passer = np.flatnonzero(~take)
+        self.chips[passer, self.seat[passer]] -= 1
+        self.pool[passer] += 1
+        self.seat[passer] = (self.seat[passer] + 1) % self.n_players
+
+        self.turns += 1
+        self.turns_played += self.n_games
+
+        finished = np.flatnonzero(done)
+        if len(finished):
+            self.finish(finished)
+            self.reset(finished)
+
+        return finished
+
+    def scores(self, games):
+        """
+        Returns the points of every player in the given rows.
+        """
+
+        hands = self.hands[games]
+        starts = hands & ~(hands << 1)
+        bits = (starts[..., None] >> np.arange(len(self.cards))) & 1
+
+        return self.chips[games] - bits @ self.cards
+
+    def finish(self, games):
+        """
+        Tallies the winners of the given finished games and, when learning,
+        moves the values of the visited state-action pairs towards the final
+        score of the agent.
+        """
+
+        scores = self.scores(games)
+        np.add.at(self.tally, scores.argmax(axis = 1), 1)
+        self.games_played += len(games)
+
+        if not self.learn:
+            return
+
+        length = self.episode_length[games]
+        mask = np.arange(self.max_steps) < length[:, None]
+        owner = np.broadcast_to(np.arange(len(games))[:, None], mask.shape)[mask]
+        cells = self.episode_states[games][mask] * 2 + self.episode_actions[games][mask]
+
+        # First visit only: count every state-action pair once per game
+        pairs, first = np.unique(owner * self.q.values.size + cells, return_index = True)
+        cells, owner = cells[first], owner[first]
+
+        # Games of the same batch can share a pair. Each pair moves towards the
+        # mean return as far as that many sequential updates would have taken it
+        cells, inverse, counts = np.unique(cells, return_inverse = True, return_counts = True)
+        returns = np.bincount(inverse, weights = scores[owner, self.agent_seat]) / counts
+        step_size = 1 - (1 - self.step_size) ** counts
+
+        values = self.q.values.reshape(-1)
+        values[cells] += step_size * (returns - values[cells])
+
+    def run(self, match_no):
+        """
+        Steps until at least match_no games have finished and returns the tally
+        of wins per seat.
+        """
+
+        start = self.games_played
+        while self.games_played - start < match_no:
+            self.step()
+
+        return self.tally.tolist()
@@ -0,0 +1,251 @@
+from collections import defaultdict
+
+import numpy as np
+
+from untitled4 import StateEncoder, SparseQTable, actions, hand_scores
+
+# Exact Solver
+# ----------------------------------------------------------------------------
+
+class ExactSolver(object):
+    """
+    Computes the optimal q-values of the agent against two rand_play()
+    opponents by backward induction instead of sampling games.
+
+    From the seat of the agent the game is a Markov decision process once the
+    state of states() is extended by what decides how the game goes on:
+
+        seen   = bitmask of all cards drawn so far, the next card is drawn
+                 uniformly from the others, as with the deck of Deck.build
+        r      = the number of cards still in the deck
+        c0, c1 = the chips of the player after the agent and the one after
+                 that (they only matter because a player without chips has
+                 to take)
+
+    The opponents take or pass on a coin flip unless they are out of chips,
+    and the game ends as soon as the deck is empty after a move, like in
+    GameEngine. Every move either draws a card (r goes down) or puts a chip
+    on the open card (the pool goes up), so the values are computed
+    recursively from the last card backwards and each state is solved once.
+    agent() gives the exact q-values of a full state and start() the expected
+    final score of the optimal policy.
+
+    solve() exports the result in the table format of the agents: q-values
+    over the encoder index, averaged over seen, r, c0 and c1 by how likely
+    each of them is when the optimal policy is played. The agents cannot see
+    these parts of the state, so a greedy policy on the exported table is an
+    approximation of the optimal policy, not the optimal policy itself.
+
+    Solving the standard game takes about a minute and 1.5 GB of memory.
+    """
+
+    def __init__(self, cards = range(3,12), n_draw = 6, chips = 3):
+        self.cards = list(cards)
+        self.low = self.cards[0]
+        self.n_draw = n_draw
+        self.chips = chips
+        self.encoder = StateEncoder(cards)
+
+        self.agent_values = dict()
+        self.opponent_values = dict()
+
+    def free_cards(self, mask):
+        """
+        Cards that can come up next if the cards in mask are ruled out.
+        """
+
+        return [card for card in self.cards if not mask >> (card - self.low) & 1]
+
+    def agent(self, card, pool, chips, hand, seen, r, c0, c1):
+        """
+        Returns (q take, q pass) at a decision of the agent, q pass is None if
+        the agent has no chips. Cards are positive, hand and seen are bitmasks.
+        """
+
+        key = (card, pool, chips, hand, seen, r, c0, c1)
+        if key in self.agent_values:
+            return self.agent_values[key]
+
+        # Take: the agent keeps the card and chips and draws the next card
+        taken = hand | 1 << (card - self.low)
+        if r == 0:
+            q_take = hand_scores[taken] + chips + pool
+        else:
+            free = self.free_cards(seen)
+            q_take = sum(self.best(self.agent(i, 0, chips + pool, taken, seen | self.bit(i), r - 1, c0, c1)) for i in free) / len(free)
+
+        # Pass: one chip on the card and the opponents are up
+        if chips == 0:
+            q_pass = None
+        elif r == 0:
+            q_pass = hand_scores[hand] + chips - 1
+        else:
+            q_pass = self.opponent(0, card, pool + 1, chips - 1, hand, seen, r, c0, c1)
+
+        self.agent_values[key] = (q_take, q_pass)
+
+        return q_take, q_pass
+
+    def bit(self, card):
+        return 1 << (card - self.low)
+
+    def best(self, q):
+        return q[0] if q[1] is None else max(q)
+
+    def opponent(self, seat, card, pool, chips, hand, seen, r, c0, c1):
+        """
+        Returns the expected final score of the agent when opponent seat (0 or
+        1) is up. chips and hand are those of the agent.
+        """
+
+        # The last card has been drawn, whatever happens now ends the game
+        if r == 0:
+            return hand_scores[hand] + chips
+
+        key = (seat, card, pool, chips, hand, seen, r, c0, c1)
+        if key in self.opponent_values:
+            return self.opponent_values[key]
+
+        own = c0 if seat == 0 else c1
+        p_take = 1.0 if own == 0 else 0.5
+
+        # Take: the opponent draws the next card and is up again
+        t0, t1 = (c0 + pool, c1) if seat == 0 else (c0, c1 + pool)
+        free = self.free_cards(seen)
+        value = p_take * sum(self.opponent(seat, i, 0, chips, hand, seen | self.bit(i), r - 1, t0, t1) for i in free) / len(free)
+
+        # Pass: one chip on the card and the next player is up
+        if p_take < 1:
+            p0, p1 = (c0 - 1, c1) if seat == 0 else (c0, c1 - 1)
+            if seat == 0:
+                after = self.opponent(1, card, pool + 1, chips, hand, seen, r, p0, p1)
+            else:
+                after = self.best(self.agent(card, pool + 1, chips, hand, seen, r, p0, p1))
+            value += (1 - p_take) * after
+
+        self.opponent_values[key] = value
+
+        return value
+
+    def start(self):
+        """
+        Expected final score of the agent under the optimal policy, before the
+        first card is drawn.
+        """
+
+        r = self.n_draw - 1
+        c = self.chips
+
+        return sum(self.opponent(0, i, 0, c, 0, self.bit(i), r, c, c) for i in self.cards) / len(self.cards)
+
+    def occupancy(self):
+        """
+        Plays the optimal policy forward and returns how likely the game is to
+        pass through each decision of the agent, keyed like agent().
+        Ties between the actions are split evenly, like the random tie break
+        of the agents.
+        """
+
+        # Moves only ever draw a card or add a chip, so the states can be
+        # visited in order of (cards drawn, pool) with every state complete
+        # before it is expanded.
+        levels = defaultdict(lambda: defaultdict(float))
+        visits = defaultdict(float)
+
+        r, c = self.n_draw - 1, self.chips
+        for i in self.cards:
+            levels[(0, 0)][("opponent", 0, i, 0, c, 0, self.bit(i), r, c, c)] += 1 / len(self.cards)
+
+        for drawn in range(self.n_draw):
+            for pool in range(3 * self.chips + 1):
+                for node, prob in levels.pop((drawn, pool), dict()).items():
+                    for child, share in self.successors(node):
+                        levels[self.level(child)][child] += prob * share
+
+                    if node[0] == "agent":
+                        visits[node[1:]] += prob
+
+        return visits
+
+    def level(self, node):
+        """
+        Returns (cards drawn, pool) of a state.
+        """
+
+        pool = node[2] if node[0] == "agent" else node[3]
+
+        return self.n_draw - 1 - node[-3], pool
+
+    def successors(self, node):
+        """
+        Returns the non-terminal states that follow node as (state, probability).
+        """
+
+        if node[0] == "agent":
+            card, pool, chips, hand, seen, r, c0, c1 = node[1:]
+            q_take, q_pass = self.agent(card, pool, chips, hand, seen, r, c0, c1)
+
+            if q_pass is None or q_take > q_pass:
+                p_take = 1.0
+            elif q_take == q_pass:
+                p_take = 0.5
+            else:
+                p_take = 0.0
+
+            result = []
+            if p_take > 0 and r > 0:
+                taken = hand | 1 << (card - self.low)
+                free = self.free_cards(seen)
+                result += [(("agent", i, 0, chips + pool, taken, seen | self.bit(i), r - 1, c0, c1), p_take / len(free)) for i in free]
+            if p_take < 1 and r > 0:
+                result.append((("opponent", 0, card, pool + 1, chips - 1, hand, seen, r, c0, c1), 1 - p_take))
+
+            return result
+
+        seat, card, pool, chips, hand, seen, r, c0, c1 = node[1:]
+        if r == 0:
+            return []
+
+        own = c0 if seat == 0 else c1
+        p_take = 1.0 if own == 0 else 0.5
+
+        t0, t1 = (c0 + pool, c1) if seat == 0 else (c0, c1 + pool)
+        free = self.free_cards(seen)
+        result = [(("opponent", seat, i, 0, chips, hand, seen | self.bit(i), r - 1, t0, t1), p_take / len(free)) for i in free]
+
+        if p_take < 1:
+            p0, p1 = (c0 - 1, c1) if seat == 0 else (c0, c1 - 1)
+            if seat == 0:
+                result.append((("opponent", 1, card, pool + 1, chips, hand, seen, r, p0, p1), 1 - p_take))
+            else:
+                result.append((("agent", card, pool + 1, chips, hand, seen, r, p0, p1), 1 - p_take))
+
+        return result
+
+    def solve(self):
+        """
+        Solves the game and returns the optimal q-values as a SparseQTable over
+        the encoder index, with a row for every state the optimal policy can
+        reach. Taking is the only action at states without chips, their pass
+        value is set to -inf.
+        """
+
+        self.start()
+        visits = self.occupancy()
+
+        totals = defaultdict(lambda: np.zeros(2))
+        weights = defaultdict(float)
+
+        for (card, pool, chips, hand, seen, r, c0, c1), prob in visits.items():
+            q_take, q_pass = self.agent(card, pool, chips, hand, seen, r, c0, c1)
+            state = self.encoder.encode_parts(-card, pool, chips, hand)
+
+            totals[state] += prob * np.array([q_take, -np.inf if q_pass is None else q_pass])
+            weights[state] += prob
+
+        table = SparseQTable(actions())
+        for state in sorted(totals):
+            row = table.row(state)
+            table.values[row] = totals[state] / weights[state]
+
+        return table
@@ -0,0 +1,155 @@
+import itertools
+import math
+import random
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from tracing import null_tracer
+from untitled4 import GameEngine, LinearQ, SparseQTable, new_agent, agent_init_info
+
+# Search Spaces
+# ----------------------------------------------------------------------------
+#
+# A trial is a dict of settings. "algo" picks the agent (see new_agent(),
+# "monte-carlo" by default), "epsilon_decay" and "step_size_decay" shrink
+# epsilon and a numeric step size by that factor per game played, and all
+# other keys go into agent_info on top of agent_init_info, e.g. "epsilon",
+# "step_size", "visit", "n_step" or "lambda".
+
+def grid(**axes):
+    """
+    Returns one trial for every combination of the given values:
+
+        grid(epsilon = [0.1, 0.2], step_size = [0.1, 0.2, "sample-average"])
+    """
+
+    names = list(axes)
+
+    return [dict(zip(names, values)) for values in itertools.product(*axes.values())]
+
+def sample(n, seed = 0, **axes):
+    """
+    Returns n trials drawn at random. An axis is either a list to choose
+    from, a range (low, high) drawn uniformly or ("log", low, high) drawn
+    uniformly on a log scale:
+
+        sample(20, epsilon = (0.01, 0.3), step_size = ("log", 0.01, 0.5),
+               algo = ["monte-carlo", "q-learning"])
+    """
+
+    rng = random.Random(seed)
+    trials = []
+
+    for i in range(n):
+        trial = dict()
+        for name, axis in axes.items():
+            if isinstance(axis, list):
+                trial[name] = rng.choice(axis)
+            elif axis[0] == "log":
+                trial[name] = math.exp(rng.uniform(math.log(axis[1]), math.log(axis[2])))
+            else:
+                trial[name] = rng.uniform(axis[0], axis[1])
+        trials.append(trial)
+
+    return trials
+
+# Trials
+# ----------------------------------------------------------------------------
+
+def run_trial(trial, games, seed, snapshot = None, played = 0):
+    """
+    Trains the agent of a trial for games more games, starting from the table
+    or weights in snapshot after played games, and returns
+    (wins of the agent, sum of its scores, new snapshot).
+    """
+
+    random.seed(seed)
+
+    settings = dict(trial)
+    algo = settings.pop("algo", "monte-carlo")
+    epsilon_decay = settings.pop("epsilon_decay", 1.0)
+    step_size_decay = settings.pop("step_size_decay", 1.0)
+    settings["seed"] = seed
+
+    agent = new_agent(algo, dict(agent_init_info, tracer = null_tracer, **settings))
+    if snapshot is not None:
+        if isinstance(agent.q, LinearQ):
+            agent.q.weights = snapshot.copy()
+        else:
+            agent.q = SparseQTable.from_snapshot(agent.actions, snapshot, agent.q.init)
+
+    game = GameEngine(agent, algo, config = agent.config)
+    epsilon, step_size = agent.epsilon, agent.step_size
+    wins, score = 0, 0
+
+    # The schedules are applied every 100 games
+    for start in range(0, games, 100):
+        agent.epsilon = epsilon * epsilon_decay ** (played + start)
+        if not isinstance(step_size, str):
+            agent.step_size = step_size * step_size_decay ** (played + start)
+
+        for i in range(min(100, games - start)):
+            result = game.play()
+            wins += result.winner == game.n_players - 1
+            score += result.scores[-1]
+
+    if isinstance(agent.q, LinearQ):
+        return wins, score, agent.q.weights.copy()
+
+    return wins, score, agent.q.snapshot()
+
+def successive_halving(trials, min_games = 1000, eta = 3, workers = 1, seed = 0):
+    """
+    Tunes the trials by successive halving. In the first rung every trial
+    trains for min_games games, then only the best 1/eta of them by their
+    win rate in that rung go on, now for eta times as many games in total,
+    and so on until one trial is left. Trials continue from their table, so
+    a trial that reaches rung r has played min_games * eta^r games.
+
+    Trials of a rung run side by side on workers processes, each with its own
+    seed derived from seed, the trial and the rung, so sweeps can be repeated.
+
+    Returns one row per trial with its settings, the last rung it reached,
+    the games it played and its win rate and mean score in that rung, best
+    first.
+    """
+
+    records = [dict(trial = i, rung = 0, games = 0, win_rate = np.nan, score = np.nan) for i in range(len(trials))]
+    snapshots = [None] * len(trials)
+    alive = list(range(len(trials)))
+    rung = 0
+
+    pool = ProcessPoolExecutor(max_workers = workers) if workers > 1 else None
+
+    try:
+        while alive:
+            budget = min_games * eta ** rung
+            futures = dict()
+
+            for i in alive:
+                args = (trials[i], budget - records[i]["games"], seed + 1000 * i + rung, snapshots[i], records[i]["games"])
+                futures[i] = pool.submit(run_trial, *args) if pool is not None else args
+
+            for i in alive:
+                future = futures[i]
+                wins, score, snapshots[i] = future.result() if pool is not None else run_trial(*future)
+
+                games = budget - records[i]["games"]
+                records[i].update(rung = rung, games = budget, win_rate = wins / games, score = score / games)
+
+            if len(alive) == 1:
+                break
+
+            # The best 1/eta go on to the next rung
+            alive.sort(key = lambda i: records[i]["win_rate"], reverse = True)
+            alive = alive[:max(1, len(alive) // eta)]
+            rung += 1
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    table = pd.DataFrame([dict(trials[i], **records[i]) for i in range(len(trials))])
+
+    return table.sort_values(["rung", "win_rate"], ascending = False).reset_index(drop = True)
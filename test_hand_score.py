@@ -0,0 +1,75 @@
+import itertools
+import random
+
+from untitled4 import card_point_tally, hand_mask, hand_score, hand_scores, run_score
+
+# Equivalence with the original scoring
+# ----------------------------------------------------------------------------
+#
+# card_point_tally() used to sort the hand and remove the lower card of every
+# consecutive pair in place. These tests compare the lookup table against
+# that implementation on random hands, shuffled and zero padded like the
+# hands in the states, with fixed seeds so failures can be repeated.
+
+def reference_tally(hand):
+    """
+    The original card_point_tally(), which changes its argument.
+    """
+
+    hand.sort()
+
+    i = 1
+    while i < len(hand):
+        if hand[i] == hand[i-1] + 1:
+            hand.remove(hand[i-1])
+        else:
+            i += 1
+
+    return sum(hand)
+
+def random_hands(n, seed = 0, padding = 0):
+    """
+    Yields n hands of 0-9 distinct cards in random order as negative numbers,
+    with up to padding zeros mixed in.
+    """
+
+    rng = random.Random(seed)
+
+    for i in range(n):
+        hand = [-card for card in rng.sample(range(3,12), rng.randint(0, 9))]
+        hand += [0] * rng.randint(0, padding)
+        rng.shuffle(hand)
+
+        yield hand
+
+def test_every_hand():
+    for n in range(10):
+        for cards in itertools.combinations(range(3,12), n):
+            hand = [-card for card in cards]
+
+            assert card_point_tally(hand) == reference_tally(list(hand))
+
+def test_random_shuffled_hands():
+    for hand in random_hands(5000, seed = 1):
+        assert card_point_tally(hand) == reference_tally(list(hand))
+
+def test_zero_padding():
+    for hand in random_hands(5000, seed = 2, padding = 6):
+        assert card_point_tally(hand) == reference_tally(list(hand))
+        assert card_point_tally(hand) == card_point_tally([card for card in hand if card != 0])
+
+def test_hand_is_not_changed():
+    for hand in random_hands(1000, seed = 3, padding = 3):
+        before = list(hand)
+        card_point_tally(hand)
+
+        assert hand == before
+
+def test_bitmask_scores():
+    for hand in random_hands(1000, seed = 4, padding = 3):
+        mask = hand_mask(hand)
+
+        assert hand_score(mask) == reference_tally(list(hand))
+        assert run_score(mask) == hand_score(mask)
+
+    assert len(hand_scores) == 512
@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+
+import untitled4
+from untitled4 import new_agent, parallel_tournament, agent_init_info
+
+# Merging of worker tables
+# ----------------------------------------------------------------------------
+#
+# With a step size of 0 the agent never changes a value, so whatever the
+# workers play, every row of the merged table has to stay where a new row
+# starts. Replay and trace agents start new rows at the rewards of their
+# state, which merge_deltas() must not add a second time.
+
+def merged_start_error(agent_info, merge):
+    """
+    Returns the largest distance of a merged value from the rewards.
+    """
+
+    tally, q = parallel_tournament(1000, "q-learning", agent_info, 2, sync_every = 250, merge = merge)
+    rewards = new_agent("q-learning", agent_info).R
+    n = len(q)
+
+    assert n > 0
+
+    return np.abs(q.values[:n] - rewards.values[q.index[:n]]).max()
+
+def test_traces_keep_their_start_values():
+    agent_info = dict(agent_init_info, step_size = 0.0, **{"lambda": 0.5})
+
+    for merge in ["average", "weighted"]:
+        assert merged_start_error(agent_info, merge) == 0
+
+def test_replay_keeps_its_start_values():
+    agent_info = dict(agent_init_info, step_size = 0.0, replay = 500)
+
+    for merge in ["average", "weighted"]:
+        assert merged_start_error(agent_info, merge) == 0
+
+# Failing workers
+# ----------------------------------------------------------------------------
+
+def failing_worker(*args):
+    raise SystemExit(1)
+
+def test_shared_tournament_raises_when_a_worker_fails(monkeypatch, tmp_path):
+    monkeypatch.setattr(untitled4, "shared_worker", failing_worker)
+    agent_info = dict(agent_init_info, model_path = str(tmp_path / "model"))
+
+    with pytest.raises(RuntimeError):
+        untitled4.Tournament("Alice", "Bob", "Charlie", 100, "monte-carlo", agent_info, workers = 2, shared = True)
+
+    assert not (tmp_path / "model").exists()
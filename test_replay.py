@@ -0,0 +1,50 @@
+import random
+
+import numpy as np
+
+from tracing import null_tracer
+from untitled4 import GameEngine, new_agent, agent_init_info
+
+# Replay Updates
+# ----------------------------------------------------------------------------
+#
+# Every replay target is a final score or a value of the table, and new rows
+# start at the rewards of reachable states, so no update may take a value
+# outside the scores a game can end with. Minibatches are drawn with
+# replacement, which used to move a pair drawn k times by k steps from the
+# same old value.
+
+def trained_values(**replay_info):
+    """
+    Returns the range of final scores of the game and the values of the
+    visited rows of a q-learning agent with replay after 300 games.
+    """
+
+    random.seed(0)
+
+    agent = new_agent("q-learning", dict(agent_init_info, tracer = null_tracer, seed = 0, **replay_info))
+    game = GameEngine(agent, "q-learning", config = agent.config)
+
+    for i in range(300):
+        game.play()
+
+    # At best a player ends with every chip and no card, at worst with no
+    # chip and every card
+    config = agent.config
+    scores = (-sum(config.cards), config.chips * config.players)
+
+    return scores, agent.q.values[:len(agent.q)]
+
+def assert_within_scores(scores, values):
+    assert np.isfinite(values).all()
+    assert values.min() >= scores[0] - 1e-9
+    assert values.max() <= scores[1] + 1e-9
+
+def test_default_replay_stays_within_scores():
+    assert_within_scores(*trained_values(replay = 1000))
+
+def test_small_buffer_stays_within_scores():
+    assert_within_scores(*trained_values(replay = 20, replay_batch = 256))
+
+def test_large_batch_stays_within_scores():
+    assert_within_scores(*trained_values(replay = 1000, replay_batch = 1024))
@@ -0,0 +1,148 @@
+import json
+import random
+
+# Levels
+# ----------------------------------------------------------------------------
+
+DEBUG = 10
+INFO = 20
+OFF = 100
+
+# Tracers
+# ----------------------------------------------------------------------------
+
+class Tracer(object):
+    """
+    The default tracer, which records nothing. Code on a hot path only
+    compares against the level before it builds an event:
+
+        if tracer.level <= DEBUG:
+            tracer.emit(DEBUG, "q_update", state = s, q = q)
+
+    With this tracer the level is OFF, so the check is the only cost.
+    """
+
+    level = OFF
+
+    def begin_game(self):
+        pass
+
+    def emit(self, level, event, **fields):
+        pass
+
+    def end_game(self):
+        pass
+
+    def close(self):
+        pass
+
+null_tracer = Tracer()
+
+class EventTracer(Tracer):
+    """
+    Hands events of the given level and above to a sink. Games are sampled:
+    begin_game() picks a share sample of all games at random, and only events
+    of those games are recorded. Every event carries the number of its game,
+    so a trace can be replayed game by game.
+
+    Required parameters:
+        - sink as PrintSink or JsonlSink
+    """
+
+    def __init__(self, sink, level = INFO, sample = 1.0, seed = None):
+        self.sink = sink
+        self.min_level = level
+        self.sample = sample
+        self.rng = random.Random(seed)
+        self.game = 0
+
+        self.level = level
+
+    def begin_game(self):
+        self.game += 1
+
+        if self.sample >= 1 or self.rng.random() < self.sample:
+            self.level = self.min_level
+        else:
+            self.level = OFF
+
+    def emit(self, level, event, **fields):
+        if level >= self.level:
+            fields["game"] = self.game
+            fields["event"] = event
+            self.sink.write(fields)
+
+    def end_game(self):
+        self.level = self.min_level
+
+    def close(self):
+        self.sink.close()
+
+# Sinks
+# ----------------------------------------------------------------------------
+
+class PrintSink(object):
+    """
+    Prints every event to the terminal, using its "message" field if it has
+    one.
+    """
+
+    def write(self, record):
+        if "message" in record:
+            print(record["message"])
+        else:
+            print(", ".join(f'{key}: {val}' for key, val in record.items()))
+
+    def close(self):
+        pass
+
+class JsonlSink(object):
+    """
+    Writes events as one JSON object per line to path. Lines are collected in
+    memory and written in chunks of buffer_size, so tracing many games costs
+    few writes. Call close() at the end to write the rest.
+    """
+
+    def __init__(self, path, buffer_size = 10000):
+        self.file = open(path, "a")
+        self.buffer = list()
+        self.buffer_size = buffer_size
+
+    def write(self, record):
+        self.buffer.append(json.dumps(record, default = lambda value: value.item()))
+
+        if len(self.buffer) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            self.file.write("\n".join(self.buffer) + "\n")
+            self.buffer = list()
+
+        self.file.flush()
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+def replay(path):
+    """
+    Reads a JSONL trace back and yields the events of one game at a time as
+    (game number, list of events).
+    """
+
+    game, events = None, list()
+
+    with open(path) as file:
+        for line in file:
+            record = json.loads(line)
+
+            if record["game"] != game and events:
+                yield game, events
+                events = list()
+
+            game = record["game"]
+            events.append(record)
+
+    if events:
+        yield game, events
@@ -2,8 +2,19 @@ import random
 import numpy as np
 import pandas as pd
 import itertools
+import functools
+import math
+import os
+import contextlib
+import multiprocessing
+from multiprocessing import shared_memory
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
 import matplotlib.pyplot as plt
 
+from tracing import DEBUG, INFO, null_tracer
+from results import ResultBuffer, ResultWriter
+
 # 1. State, Action and Reward
 # ----------------------------------------------------------------------------
     
@@ -49,14 +60,161 @@ def states():
             
     return states
 
-def state_dict(states = states()):
+class StateSpace(object):
+    """
+    Lazy view of the states returned by states(). The number of states is 
+    computed analytically and the states themselves are only generated when 
+    iterated over, in the same order as states(), so nothing is enumerated 
+    until it is actually needed.
+    """
+    
+    def __init__(self, cards = range(3,12), max_chips = 12, hand_slots = 6):
+        self.cards = list(cards)
+        self.max_chips = max_chips
+        self.hand_slots = hand_slots
+        
+    def __len__(self):
+        hands = sum(math.comb(len(self.cards) - 1, i) for i in range(self.hand_slots + 1))
+        
+        return len(self.cards) * (self.max_chips + 1) ** 2 * hands
+    
+    def __iter__(self):
+        player_cards = [-i for i in self.cards]
+        chip_states = range(self.max_chips + 1)
+        
+        for player_chips in chip_states:
+            for open_chips in chip_states:
+                for open_card in player_cards:
+                    for i in range(self.hand_slots + 1):
+                        for combo in itertools.combinations(player_cards, i):
+                            if open_card in combo:
+                                continue
+                            yield [open_card, open_chips, player_chips] + [0] * (self.hand_slots - i) + list(combo)
+                            
+    def __contains__(self, state):
+        hand = [i for i in state[3:] if i != 0]
+        
+        return (len(state) == self.hand_slots + 3
+                and -state[0] in self.cards
+                and 0 <= state[1] <= self.max_chips
+                and 0 <= state[2] <= self.max_chips
+                and len(hand) <= self.hand_slots
+                and len(set(hand)) == len(hand)
+                and all(-i in self.cards for i in hand)
+                and state[0] not in hand)
 
-    state_dict = dict()
+class StateEncoder(object):
+    """
+    Maps a state to a dense integer index with mixed-radix arithmetic, so the 
+    agents can address their tables without building a string or keeping a 
+    dictionary of every state.
+    
+    The state is split into four digits:
+        
+        open card    -> position of the card in the deck range
+        open chips   -> number of chips on the open card
+        player chips -> number of chips of the player
+        hand         -> bitmask over the deck range, bit i set if the player 
+                        holds the i-th card
+                        
+    index = ((card * n_chips + open_chips) * n_chips + player_chips) * 2**n_cards + hand
+    
+    Every index decodes back to a state in the same layout identify_state() 
+    produces. Indices of impossible states (e.g. the open card in the hand) 
+    simply stay unused.
+    """
+    
+    def __init__(self, cards = range(3,12), max_chips = 12, hand_slots = 6):
+        self.cards = list(cards)
+        self.low = self.cards[0]
+        self.n_cards = len(self.cards)
+        self.n_chips = max_chips + 1
+        self.n_hands = 2 ** self.n_cards
+        self.hand_slots = hand_slots
+        
+        self.n_states = self.n_cards * self.n_chips * self.n_chips * self.n_hands
+        
+    def __len__(self):
+        return self.n_states
+    
+    def hand_mask(self, hand):
+        """
+        Turns a list of (negative, zero padded) cards into a bitmask.
+        """
+        
+        mask = 0
+        for card in hand:
+            if card != 0:
+                mask |= 1 << (-card - self.low)
+        
+        return mask
+    
+    def hand_cards(self, mask):
+        """
+        Turns a bitmask back into the zero padded card list used in states.
+        """
+        
+        hand = [-(self.low + i) for i in range(self.n_cards) if mask >> i & 1]
+        while len(hand) < self.hand_slots:
+            hand.insert(0,0)
+            
+        return hand
+    
+    def encode_parts(self, open_card, open_chips, player_chips, hand_mask):
+        """
+        Encodes the four digits of a state. The open card is given as in the 
+        states, i.e. negative.
+        """
+        
+        index = (-open_card - self.low) * self.n_chips + open_chips
+        index = index * self.n_chips + player_chips
+        
+        return index * self.n_hands + hand_mask
     
-    for val in range(len(states)):
-        state_dict[str(states[val])] = val
+    def encode(self, state):
+        """
+        Encodes a state list [open card, open chips, player chips, *hand].
+        """
+        
+        return self.encode_parts(state[0], state[1], state[2], self.hand_mask(state[3:]))
+    
+    def decode_parts(self, index):
+        """
+        Reverses encode_parts(), for a single index or an int array of them.
+        """
+        
+        index, hand_mask = divmod(index, self.n_hands)
+        index, player_chips = divmod(index, self.n_chips)
+        card, open_chips = divmod(index, self.n_chips)
+        
+        return -(card + self.low), open_chips, player_chips, hand_mask
+    
+    def player_chips(self, index):
+        """
+        Returns only the chips of the player, which decide whether passing is 
+        allowed, for a single index or an int array of them.
+        """
+        
+        return index // self.n_hands % self.n_chips
+    
+    def hand_size(self, hand_mask):
+        """
+        Returns the number of cards in a hand bitmask or an int array of them.
+        """
+        
+        if isinstance(hand_mask, int):
+            return hand_mask.bit_count()
+        
+        return sum((hand_mask >> i) & 1 for i in range(self.n_cards))
     
-    return state_dict
+    def decode(self, index):
+        """
+        Reverses encode().
+        """
+        
+        open_card, open_chips, player_chips, hand_mask = self.decode_parts(index)
+        
+        return [open_card, open_chips, player_chips] + self.hand_cards(hand_mask)
     
 def actions():
     """
@@ -69,486 +227,2235 @@ def actions():
     
     return actions_all
 
+def hand_score_table(cards = range(3,12)):
+    """
+    Computes the points of every hand bitmask at once. Entry i holds the 
+    (negative) points of the hand whose cards are the set bits of i, so only 
+    the lowest card of each run counts.
+    """
+    
+    cards = np.asarray(list(cards))
+    masks = np.arange(2 ** len(cards))
+    
+    # A card starts a run if it is held and the card below it is not
+    starts = masks & ~(masks << 1)
+    bits = (starts[:, None] >> np.arange(len(cards))) & 1
+    
+    return -(bits @ cards)
+
+hand_scores = hand_score_table().tolist()
+
+def hand_mask(hand):
+    """
+    Turns a hand into a bitmask over the cards 3-11, bit i is set if the card 
+    i+3 is in the hand. Cards may be given as negative numbers like in the 
+    states, zero padding is ignored. The hand is not changed.
+    """
+    
+    mask = 0
+    for card in hand:
+        if card != 0:
+            mask |= 1 << (abs(card) - 3)
+            
+    return mask
+
+def hand_score(mask):
+    """
+    Returns the points of a hand bitmask from the precomputed table.
+    """
+    
+    return hand_scores[mask]
+
+def run_score(mask, low = 3):
+    """
+    Returns the points of a hand bitmask of any size without a lookup table, 
+    for decks too large for hand_score_table(). Bit i stands for the card 
+    low+i.
+    """
+    
+    starts = mask & ~(mask << 1)
+    score = 0
+    
+    while starts:
+        bit = starts & -starts
+        score -= low + bit.bit_length() - 1
+        starts ^= bit
+        
+    return score
+
+def run_scores(masks, cards):
+    """
+    Same as run_score() for an array of hand bitmasks over the cards, which 
+    have to be consecutive.
+    """
+    
+    masks = np.asarray(masks, dtype = np.int64)
+    starts = masks & ~(masks << 1)
+    bits = (starts[..., None] >> np.arange(len(cards))) & 1
+    
+    return -(bits @ np.asarray(cards))
+
 def card_point_tally(hand):
     """
     Calculates the total sum of all cards in a players hand, taking into account 
     that only the lowest value card counts in a run of consecutive cards.
+    
+    Cards are held as negative numbers, so the result is negative as well. The 
+    hand is looked up in hand_scores and is left untouched.
     """
     
-    hand.sort()
+    return hand_scores[hand_mask(hand)]
     
-    i = 1
-    while i < len(hand):
-        if hand[i] == hand[i-1] + 1:
-            hand.remove(hand[i-1])
-        else:
-            i += 1
+def state_rewards(state):
+    """
+    Computes the rewards of a single state, in the order of actions(). Gives 
+    the same values as the matching row of rewards().
+    """
     
-    return sum(hand)
+    take = state[2] + state[1] + card_point_tally([state[0]] + list(state[3:]))
+    pass_ = state[2] + card_point_tally(list(state[3:])) - 1
     
-def rewards(states, actions, state_dict = state_dict()):
+    return [take, pass_]
+    
+def state_mask(encoder = StateEncoder()):
     """
-    Initialises the reward matrix. Each value corresponds to the total points of the player 
-    if action[i] is chosen at state[i].
+    Flags which indices of the encoder are states, i.e. the open card is not 
+    in the hand and the hand fits into the hand slots. The result has the 
+    shape (cards, open chips, player chips, hands) of the encoder digits; 
+    reshape it to len(encoder) for a flat mask.
     """
     
-    R = np.zeros((len(states), len(actions)))
+    hand = np.arange(encoder.n_hands)
+    card_counts = ((hand[:, None] >> np.arange(encoder.n_cards)) & 1).sum(axis = 1)
+    card = np.arange(encoder.n_cards)[:, None]
     
-    for i in range(len(states)):
-        R[i][0] = states[i][2] + states[i][1] + card_point_tally([val for idx, val in enumerate(states[i]) if idx not in [1,2]])
-        R[i][1] = states[i][2] + card_point_tally(states[i][3:12]) - 1
+    mask = ((hand >> card) & 1 == 0) & (card_counts <= encoder.hand_slots)
     
-    R = pd.DataFrame(data = R, columns = actions, index = state_dict.values())
-    
-    return R
+    return np.broadcast_to(mask[:, None, None, :], (encoder.n_cards, encoder.n_chips, encoder.n_chips, encoder.n_hands))
 
-# 2. Agents
-# ----------------------------------------------------------------------------
+def reward_matrix(encoder = StateEncoder()):
+    """
+    Builds the reward matrix for every index of the encoder in one go. Works 
+    on the four digits of the index as broadcast arrays and looks the hand 
+    points up in hand_score_table(), so no state is ever built in Python. 
+    Rows of indices that are not a state are left at zero. Columns are in 
+    the order of actions().
+    """
     
-class MonteCarloAgent(object):
+    scores = hand_score_table(encoder.cards)
+    valid = state_mask(encoder)
+    
+    card = np.arange(encoder.n_cards)[:, None, None, None]
+    open_chips = np.arange(encoder.n_chips)[None, :, None, None]
+    player_chips = np.arange(encoder.n_chips)[None, None, :, None]
+    hand = np.arange(encoder.n_hands)[None, None, None, :]
+    
+    R = np.zeros(valid.shape + (2,))
+    R[..., 0] = np.where(valid, player_chips + open_chips + scores[hand | (1 << card)], 0)
+    R[..., 1] = np.where(valid, player_chips + scores[hand] - 1, 0)
+    
+    return R.reshape(len(encoder), 2)
+    
+def rewards(states = None, actions = actions(), encoder = StateEncoder()):
     """
-    Given the discrete state-action matrix, the agent navigates through the 
-    fields by simulating multiple games. While the matrix is initialized with 
-    all values at zero, Monte Carlo (MC) updates all visited state-action 
-    values after every completed game.
+    Initialises the reward matrix. Each value corresponds to the total points of the player 
+    if action[i] is chosen at state[i]. 
     
-    q(s,a) = q(s,a) + (alpha) * (R - q(s,a))
-
-    The q-value at state s taking action a is updated dependent on the 
-    achieved reward in this episode R, and the step size parameter alpha. In 
-    order to decide which action to take in a respective state, the 
-    epsilon-greedy form of the algorithm chooses:
-
-    With epsilon probability: Random action
-    With 1-epsilon probability: Action with maximum q-values
+    This is a DataFrame view of reward_matrix() for analysis, indexed by the 
+    encoder index of each state. Without states, all states are included.
     """
     
-    def agent_init(self, agent_init_info):
-        """
-        Initializes the agent to get parameters and import/create q-tables.
-        Required parameters: agent_init_info as dict
-        """
-        
-        # (1) Store the parameters provided in agent_init_info
-        self.states = states()
-        self.state_dict = state_dict()
-        self.actions = actions()
-        self.state_seen = list()
-        self.action_seen = list()
-        self.q_seen = list()
+    R = reward_matrix(encoder)
+    
+    if states is None:
+        index = np.flatnonzero(state_mask(encoder))
+    else:
+        index = [encoder.encode(state) for state in states]
+    
+    R = pd.DataFrame(data = R[index], columns = actions, index = index)
+    
+    return R
+
+class GameConfig(object):
+    """
+    The settings of a game of No Thanks!, which the engine, the state encoder 
+    and the rewards are all built from:
         
-        self.epsilon = agent_init_info["epsilon"]
-        self.step_size = agent_init_info["step_size"]
-        self.R = rewards(self.states, self.actions)
+        cards   -> the deck, range(3,12) by default and range(3,36) in the 
+                   real game
+        removed -> cards taken out of the deck unseen before the game
+        chips   -> starting chips of every player
+        players -> number of players, the agent included
         
-        self.q = pd.DataFrame(data = np.zeros((len(self.states),len(self.actions))), columns = self.actions, index = self.state_dict.values())
-        self.visit = self.q.copy()
+    The default is the small game this project was built around: 6 of the 
+    cards 3-11 and three players with 3 chips each. The real game uses 
+    GameConfig(range(3,36), 9, 11, 3) for 3-5 players, 9 chips for 6 and 7 
+    chips for 7 players.
+    
+    Hand points come from hand_score_table() while the deck is small enough 
+    for a table and from run_score() otherwise.
+    """
+    
+    max_table_cards = 16
+    
+    def __init__(self, cards = range(3,12), removed = 3, chips = 3, players = 3):
+        self.cards = list(cards)
+        self.low = self.cards[0]
+        self.removed = removed
+        self.chips = chips
+        self.players = players
+        self.n_draw = len(self.cards) - removed
         
-    def step(self, state_dict, actions_dict):
+        if len(self.cards) <= self.max_table_cards:
+            self.hand_score = hand_score_table(self.cards).tolist().__getitem__
+        else:
+            self.hand_score = functools.partial(run_score, low = self.low)
+            
+    def encoder(self):
         """
-        Choose the optimal next action according to the followed policy.
-        Required parameters:
-            - state_dict as dict
-            - actions_dict as dict
+        Returns the StateEncoder of this game. Chips never go below the 12 of 
+        states(), so tables of the default game keep their indices.
         """
         
-        # (1) Transform state dictionary into tuple
-        state = self.state_dict[str(state_dict)]
-        
-        # (2) Choose action using epsilon greedy
-        # (2a) Random action
-        if random.random() < self.epsilon:
-            actions_possible = [key for key,val in actions_dict.items() if val != 0]
-            action = random.choice(actions_possible)
-         
-        # (2b) Greedy action
-        else:
-            actions_possible = [key for key,val in actions_dict.items() if val != 0]
-            random.shuffle(actions_possible)
-            val_max = 0
-        
-            for i in actions_possible:
-                val = self.q.loc[state,i]
-                if val >= val_max:
-                    val_max = val
-                    action = i
-        
-        # (3) Add state-action pair if not seen in this simulation
-        if (state,action) not in self.q_seen:
-            self.state_seen.append(state)
-            self.action_seen.append(action)
-            
-        self.q_seen.append((state,action))
-        self.visit.loc[state, action] += 1
+        return StateEncoder(self.cards, max(12, self.chips * self.players), min(self.n_draw, len(self.cards) - 1))
+    
+    def state_space(self):
+        encoder = self.encoder()
         
-        return action
+        return StateSpace(self.cards, encoder.n_chips - 1, encoder.hand_slots)
     
-    def update(self, state_dict, action):
+    def state_rewards(self, encoder, state):
         """
-        Updating Q-values according to Belman equation
-        Required parameters:
-            - state_dict as dict
-            - action as str
+        Returns the rewards of one encoded state, in the order of actions().
         """
         
-        state = [i for i in state_dict.values()]
-        state = tuple(state)
-        reward = self.R.loc[state, action]
-        
-        # Update Q-values of all state-action pairs visited in the simulation
-        for s,a in zip(self.state_seen, self.action_seen):
-            self.q.loc[s, a] += self.step_size * (reward - self.q.loc[s, a])
-            print(self.q.loc[s,a])
-            
-        self.state_seen, self.action_seen, self.q_seen = list(), list(), list()
-        
+        open_card, open_chips, player_chips, mask = encoder.decode_parts(state)
+        take = player_chips + open_chips + self.hand_score(mask | 1 << (-open_card - self.low))
         
-class QLearningAgent(object):
+        return [take, player_chips + self.hand_score(mask) - 1]
+    
+def reward_table(config, encoder):
+    """
+    Returns the rewards of the game as a table for the agents. While the deck 
+    is small, this is a QTable over the whole encoder from reward_matrix(). 
+    Otherwise it is a SparseQTable that computes the rewards of a state the 
+    first time it is looked up, so memory grows with the visited states.
     """
-    In its basic form, Q-learning works in a similar way. However, while MC 
-    waits for the completion of each episode before updating q-values, 
-    Q-learning updates them with a lag of one step, at each step.
     
-    q(s,a) = q(s,a) + (alpha) * (r + q(s-hat,a-hat) - q(s,a))
+    if len(config.cards) <= config.max_table_cards:
+        return QTable(len(encoder), actions(), values = reward_matrix(encoder))
     
-    The q-value is thereby dependent on the step-size parameter, the reward of 
-    the next step r, and the q-value of the next step at state s-hat and 
-    action-hat.
+    return SparseQTable(actions(), init = functools.partial(config.state_rewards, encoder))
 
-    Both algorithms consequently take the same 2 parameters which have the 
-    following effects:
-
-    Alpha: A higher step size parameter increases the change in q-values at 
-    each update while prohibiting values to converge closer to their true 
-    optimum.
+class ExactAbstraction(object):
+    """
+    The identity abstraction: the key of a state is its encoder index, so 
+    the agents learn on the exact states.
     
-    Epsilon: A higher epsilon grants more exploration of actions, which do not
-    appear profitable at first sight. At the same time, this dilutes the 
-    optimal game strategy when it has been picked up by the agent.
+    An abstraction maps the encoder index of a state to the key of a smaller 
+    table. key() maps one state and keys() an array of them, len() is the 
+    number of keys. The agents take one under "abstraction" in 
+    agent_init_info, by name from abstractions or as an instance.
     """
     
-    def agent_init(self, agent_init_info):
-        """
-        Initializes the agent to get parameters and import/create q-tables.
-        Required parameters: agent_init_info as dict
-        """
+    exact = True
+    
+    def __init__(self, encoder):
+        self.encoder = encoder
         
-        # (1) Store the parameters provided in agent_init_info
-        self.states = states()
-        self.state_dict = state_dict()
-        self.actions = actions()
-        self.prev_state = 0
-        self.prev_action = 0
+    def __len__(self):
+        return len(self.encoder)
+    
+    def key(self, state):
+        return state
+    
+    def keys(self, states):
+        return np.asarray(states, dtype = np.int64)
+    
+class RunAbstraction(ExactAbstraction):
+    """
+    Keeps only what matters for the open card:
         
-        self.epsilon = agent_init_info["epsilon"]
-        self.step_size = agent_init_info["step_size"]
-        self.R = rewards(self.states, self.actions)
+        open card    -> as in the encoder
+        adjacency    -> whether the cards right below and right above the open 
+                        card are in the hand, i.e. whether taking it extends 
+                        or joins a run
+        open chips   -> capped at pool_cap
+        player chips -> capped at chip_cap
+        hand size    -> number of cards in the hand, which tells how far the 
+                        game is
+    
+    For the default game this gives 12,348 keys instead of the 778,752 
+    indices of the encoder.
+    """
+    
+    exact = False
+    
+    def __init__(self, encoder, pool_cap = 6, chip_cap = 6):
+        self.encoder = encoder
+        self.pool_cap = pool_cap
+        self.chip_cap = chip_cap
+        self.n_sizes = encoder.hand_slots + 1
         
-        self.q = pd.DataFrame(data = np.zeros((len(self.states),len(self.actions))), columns = self.actions, index = self.state_dict.values())
-        self.visit = self.q.copy()
+    def __len__(self):
+        return self.encoder.n_cards * 4 * (self.pool_cap + 1) * (self.chip_cap + 1) * self.n_sizes
+    
+    def combine(self, card, adjacency, pool, chips, size):
+        key = (card * 4 + adjacency) * (self.pool_cap + 1) + pool
         
-    def step(self, state_dict, actions_dict):
+        return (key * (self.chip_cap + 1) + chips) * self.n_sizes + size
+    
+    def parts(self, state):
         """
-        Choose the optimal next action according to the followed policy.
-        Required parameters:
-            - state_dict as dict
-            - actions_dict as dict
+        Returns the bit of the open card, its adjacency, the chips on it, the 
+        chips and the hand size of the player, before capping.
         """
         
-        # (1) Transform state dictionary into tuple
-        state = self.state_dict[str(state_dict)]
-        
-        # (2) Choose action using epsilon greedy
-        # (2a) Random action
-        if random.random() < self.epsilon:
-            actions_possible = [key for key,val in actions_dict.items() if val != 0]
-            action = random.choice(actions_possible)
-         
-        # (2b) Greedy action
-        else:
-            actions_possible = [key for key,val in actions_dict.items() if val != 0]
-            random.shuffle(actions_possible)
-            val_max = 0
-            action = "take"
-            
-            for i in actions_possible:
-                val = self.q.loc[state,i]
-                if val >= val_max:
-                    val_max = val
-                    action = i
+        open_card, pool, chips, hand = self.encoder.decode_parts(state)
+        bit = -open_card - self.encoder.low
         
-        return action
-  
-    def update(self, state_dict, action):
-        """
-        Updating Q-values according to Belman equation
-        Required parameters:
-            - state_dict as dict
-            - action as str
-        """
-        state = self.state_dict[str(state_dict)]
+        # Bit i of hand << 1 stands for the card right below card i
+        adjacency = ((hand << 1) >> bit & 1) * 2 + (hand >> (bit + 1) & 1)
         
-        # (1) Set prev_state unless first turn
-        if self.prev_state != 0:
-            prev_q = self.q.loc[self.prev_state, self.prev_action]
-            this_q = self.q.loc[state, action]
-            reward = self.R.loc[state, action]
-            
-            # Calculate new Q-values
-            if reward == 0:
-                self.q.loc[self.prev_state, self.prev_action] = prev_q + self.step_size * (reward + this_q - prev_q)
-            else:
-                self.q.loc[self.prev_state, self.prev_action] = prev_q + self.step_size * (reward - prev_q)
+        return bit, adjacency, pool, chips, self.encoder.hand_size(hand)
+    
+    def key(self, state):
+        bit, adjacency, pool, chips, size = self.parts(state)
         
-            self.visit.loc[self.prev_state, self.prev_action] += 1
+        return self.combine(bit, adjacency, min(pool, self.pool_cap), min(chips, self.chip_cap), min(size, self.n_sizes - 1))
+    
+    def keys(self, states):
+        bit, adjacency, pool, chips, size = self.parts(np.asarray(states, dtype = np.int64))
         
-        # (2) Save and return action/state
-        self.prev_state = self.state_dict[str(state_dict)]
-        self.prev_action = action
+        return self.combine(bit, adjacency, np.minimum(pool, self.pool_cap), np.minimum(chips, self.chip_cap), 
+                            np.minimum(size, self.n_sizes - 1))
+    
+abstractions = {"exact": ExactAbstraction, "runs": RunAbstraction}
+
+def new_abstraction(abstraction, encoder):
+    """
+    Returns the abstraction given by name or as an instance, the exact one 
+    for None.
+    """
+    
+    if abstraction is None:
+        return ExactAbstraction(encoder)
+    if isinstance(abstraction, str):
+        return abstractions[abstraction](encoder)
+    
+    return abstraction
 
-# 3. Deck
+# 2. Agents
 # ----------------------------------------------------------------------------
 
-class Deck(object):
+def load_arrays(path, mmap_mode = None):
     """
-    Deck consists of list of numbers (cards). Is initialised with cards labelled from 3-11. 
-    Decks can be shuffled, drawn from and number of cards counted.
+    Loads all .npy files written by QTable.save() into a dict keyed by name.
     """
     
-    def __init__(self):
-        self.deck = []
-        
-    def build(self):
-        cards_all = range(3,12)
-        deck = random.sample(cards_all, 6)
-        
-        for card in deck:
-            self.deck.append(card)
+    arrays = dict()
+    
+    for file in os.listdir(path):
+        name, ext = os.path.splitext(file)
+        if ext == ".npy":
+            arrays[name] = np.load(os.path.join(path, file), mmap_mode = None if name == "actions" else mmap_mode)
             
-    def draw(self):
-        return self.deck.pop()
+    return arrays
 
-    def check_end(self):
-        if self.deck == []:
-            return True
-        
-# 4. Player
-# ----------------------------------------------------------------------------
-        
-class Player(object):
+class QTable(object):
     """
-    Player consists of a list of cards and number of chips in posession.
-    Players can take or pass cards and/or chips. Total points to player at any
-    time can be calculated.
+    Compact storage for the state-action values of an agent. Values are kept 
+    in one contiguous float array of shape (n_states, n_actions) next to an 
+    int array with the visit counts, both addressed by the integer state index 
+    and the position of the action in actions().
+    
+    Reading or writing a single cell is a plain array index, which is a lot 
+    cheaper than going through DataFrame.loc on every step and update. Use 
+    to_frame() to get a DataFrame back for analysis.
     """
     
-    def __init__(self, name):
-        self.name = name
-        self.card_hand = list()
-        self.chip_hand = 3
-        
-        self.state = list()
-        self.actions = dict()
-
-    def draw_card_rand(self, deck, player):
-        global card_pool
-        
-        card_pool = deck.draw()
+    def __init__(self, n_states, actions, values = None):
+        self.actions = list(actions)
+        self.action_index = {action: i for i, action in enumerate(self.actions)}
         
-        player.rand_play(player, deck)
-        
-    def draw_card_agent(self, deck, player):
-        global card_pool
+        if values is None:
+            values = np.zeros((n_states, len(self.actions)))
+            
+        self.values = np.ascontiguousarray(values, dtype = np.float64)
+        self.visits = np.zeros(self.values.shape, dtype = np.int64)
         
-        card_pool = deck.draw()
+    @classmethod
+    def from_frame(cls, frame):
+        """
+        Builds a table from a DataFrame with one column per action, e.g. the 
+        reward matrix returned by rewards().
+        """
         
-        player.play_agent(player, deck)
+        return cls(len(frame), frame.columns, values = frame.to_numpy())
     
-    def take_card_rand(self, player, deck):
-        global card_pool
-        global chip_pool
+    def save(self, path):
+        """
+        Writes the table to the directory path as plain .npy files, one per 
+        array, so it can be opened again with load(). Each file is written 
+        next to the old one and then swapped in, so a table that is still 
+        memory-mapped from path can be saved over itself.
+        """
         
-        self.card_hand.append(-card_pool)
-        self.chip_hand += chip_pool
+        os.makedirs(path, exist_ok = True)
         
-        chip_pool = 0
+        for name, array in self.arrays().items():
+            file = os.path.join(path, name + ".npy")
+            with open(file + ".tmp", "wb") as f:
+                np.save(f, array)
+            os.replace(file + ".tmp", file)
+            
+    def arrays(self):
+        """
+        Returns the arrays written by save().
+        """
+        
+        return {"actions": np.array(self.actions), "values": self.values, "visits": self.visits}
+    
+    @classmethod
+    def load(cls, path, mmap_mode = "c"):
+        """
+        Opens a table written by save(). The arrays are memory-mapped, so even 
+        huge tables open instantly and only the pages that are used are read.
+        
+        mmap_mode is passed on to np.load: "c" (default) keeps changes in 
+        memory and leaves the file as it is, "r" opens the table read-only, 
+        e.g. to share one table between worker processes, "r+" writes all 
+        changes back to the file.
+        """
+        
+        arrays = load_arrays(path, mmap_mode)
+        table = cls.__new__(cls)
+        table.actions = arrays["actions"].tolist()
+        table.action_index = {action: i for i, action in enumerate(table.actions)}
+        table.values = arrays["values"]
+        table.visits = arrays["visits"]
+        
+        return table
+        
+    def __len__(self):
+        return self.values.shape[0]
+    
+    def row(self, state):
+        """
+        Returns the row of the arrays that holds the given state.
+        """
+        
+        return state
+    
+    def rows_for(self, states):
+        """
+        Returns the rows of several states at once.
+        """
+        
+        return np.asarray(states, dtype = np.int64)
+    
+    def states_for(self, rows):
+        """
+        Reverses rows_for().
+        """
+        
+        return rows
+    
+    def locked(self, rows):
+        """
+        Context manager around updates of the given rows. Tables of a single 
+        process need no locks, see SharedQTable.
+        """
+        
+        return contextlib.nullcontext()
+        
+    def get(self, state, action):
+        row = self.row(state)
+        return self.values[row, self.action_index[action]]
+    
+    def set(self, state, action, value):
+        row = self.row(state)
+        self.values[row, self.action_index[action]] = value
+        
+    def visit(self, state, action):
+        row = self.row(state)
+        self.visits[row, self.action_index[action]] += 1
+        
+    def argmax(self, state, actions_dict):
+        """
+        Returns the legal action with the highest value at the given state. 
+        Ties are broken at random. Required parameters:
+            - state as int
+            - actions_dict as dict, actions with value 0 are not allowed
+        """
+        
+        # A copy, other processes may write to a shared table meanwhile
+        row = self.row(state)
+        row = self.values[row].tolist()
+        actions_possible = [key for key,val in actions_dict.items() if val != 0]
+        val_max = max(row[self.action_index[i]] for i in actions_possible)
+        best = [i for i in actions_possible if row[self.action_index[i]] == val_max]
+        
+        if len(best) == 1:
+            return best[0]
+        
+        return random.choice(best)
+    
+    def to_frame(self, index = None):
+        """
+        Exports the values as a DataFrame with one column per action.
+        """
+        
+        return pd.DataFrame(data = self.values.copy(), columns = self.actions, index = index)
+    
+    def visits_frame(self, index = None):
+        """
+        Exports the visit counts as a DataFrame with one column per action.
+        """
+        
+        return pd.DataFrame(data = self.visits.copy(), columns = self.actions, index = index)
+    
+class SparseQTable(QTable):
+    """
+    QTable that only holds rows for the states that are actually visited. 
+    New states are given the next free row the first time they are looked up 
+    and the arrays double in size whenever they run full, so memory grows 
+    with the visited states instead of the whole state space.
+    
+    An optional init function computes the starting values of a new row from 
+    its state index, e.g. to fill in rewards on demand.
+    """
+    
+    def __init__(self, actions, init = None, capacity = 1024):
+        self.actions = list(actions)
+        self.action_index = {action: i for i, action in enumerate(self.actions)}
+        self.init = init
+        
+        self.rows = dict()
+        self.index = np.zeros(capacity, dtype = np.int64)
+        self.values = np.zeros((capacity, len(self.actions)))
+        self.visits = np.zeros((capacity, len(self.actions)), dtype = np.int64)
+        
+    def __len__(self):
+        return len(self.rows)
+    
+    def __contains__(self, state):
+        return state in self.rows
+    
+    def row(self, state):
+        row = self.rows.get(state)
+        
+        if row is None:
+            row = self.add(state)
+            
+        return row
+    
+    def add(self, state):
+        """
+        Creates the row for a new state and returns it.
+        """
+        
+        row = len(self.rows)
+        
+        if row == len(self.index):
+            self.grow()
+            
+        self.rows[state] = row
+        self.index[row] = state
+        
+        if self.init is not None:
+            self.values[row] = self.init(state)
+            
+        return row
+    
+    def grow(self):
+        n = len(self.index)
+        capacity = max(1024, 2 * n)
+        
+        index = np.zeros(capacity, dtype = np.int64)
+        values = np.zeros((capacity, len(self.actions)))
+        visits = np.zeros((capacity, len(self.actions)), dtype = np.int64)
+        index[:n], values[:n], visits[:n] = self.index, self.values, self.visits
+        
+        self.index, self.values, self.visits = index, values, visits
+        
+    def to_frame(self, index = None):
+        n = len(self.rows)
+        if index is None:
+            index = self.index[:n].copy()
+        
+        return pd.DataFrame(data = self.values[:n].copy(), columns = self.actions, index = index)
+    
+    def visits_frame(self, index = None):
+        n = len(self.rows)
+        if index is None:
+            index = self.index[:n].copy()
+        
+        return pd.DataFrame(data = self.visits[:n].copy(), columns = self.actions, index = index)
+    
+    def snapshot(self):
+        """
+        Returns copies of the state indices, values and visit counts of all 
+        rows, in row order.
+        """
+        
+        n = len(self.rows)
+        
+        return self.index[:n].copy(), self.values[:n].copy(), self.visits[:n].copy()
+    
+    @classmethod
+    def from_snapshot(cls, actions, snapshot, init = None):
+        """
+        Rebuilds a table from snapshot(), keeping the row order. init is used 
+        for new rows as in the constructor.
+        """
+        
+        index, values, visits = snapshot
+        table = cls(actions, init, capacity = max(1024, len(index)))
+        
+        table.rows = {state: row for row, state in enumerate(index.tolist())}
+        table.index[:len(index)] = index
+        table.values[:len(index)] = values
+        table.visits[:len(index)] = visits
+        
+        return table
+    
+    def arrays(self):
+        n = len(self.rows)
+        
+        return {"actions": np.array(self.actions), "index": self.index[:n], "values": self.values[:n], "visits": self.visits[:n]}
+    
+    @classmethod
+    def load(cls, path, mmap_mode = "c"):
+        arrays = load_arrays(path, mmap_mode)
+        table = cls(arrays["actions"].tolist(), capacity = 0)
+        
+        table.rows = {state: row for row, state in enumerate(arrays["index"].tolist())}
+        table.index = arrays["index"]
+        table.values = arrays["values"]
+        table.visits = arrays["visits"]
+        
+        return table
+    
+    def rows_for(self, states):
+        """
+        Returns the rows of several states at once, adding the missing ones.
+        """
+        
+        return np.array([self.row(state) for state in states.tolist()], dtype = np.int64)
+    
+    def states_for(self, rows):
+        return self.index[rows]
+    
+class SharedQTable(QTable):
+    """
+    Dense QTable whose values and visit counts live in one block of 
+    multiprocessing.shared_memory, so worker processes that attach to the 
+    block by its name all read and write the same table. Nothing is pickled 
+    or merged, every update is visible to all workers at once.
+    
+    By default updates are unsynchronized (Hogwild), which is safe enough 
+    because games rarely update the same row at the same moment and a lost 
+    update only costs one step of learning. With locks, the rows are split 
+    into that many stripes with a lock each, and every update holds the locks 
+    of the stripes it touches.
+    
+    The process that create()s the table owns the block and frees it with 
+    close(), the workers attach() and only close their view of it.
+    """
+    
+    def __init__(self, memory, n_states, actions, locks = None, owner = False):
+        self.actions = list(actions)
+        self.action_index = {action: i for i, action in enumerate(self.actions)}
+        self.memory = memory
+        self.locks = locks
+        self.owner = owner
+        
+        shape = (n_states, len(self.actions))
+        self.values = np.ndarray(shape, dtype = np.float64, buffer = memory.buf)
+        self.visits = np.ndarray(shape, dtype = np.int64, buffer = memory.buf, offset = self.values.nbytes)
+        
+    @classmethod
+    def create(cls, n_states, actions, values = None, locks = 0):
+        """
+        Allocates a new shared table, with the given starting values or zeros 
+        and locks stripes of locks (0 for none).
+        """
+        
+        size = 2 * n_states * len(actions) * 8
+        memory = shared_memory.SharedMemory(create = True, size = size)
+        locks = [multiprocessing.Lock() for i in range(locks)] or None
+        
+        table = cls(memory, n_states, actions, locks, owner = True)
+        table.values[:] = 0 if values is None else values
+        table.visits[:] = 0
+        
+        return table
+    
+    @classmethod
+    def attach(cls, name, n_states, actions, locks = None):
+        """
+        Opens the shared table with the given name in another process. locks 
+        has to be the locks of the owner, handed down to the process.
+        """
+        
+        return cls(shared_memory.SharedMemory(name = name), n_states, actions, locks)
+    
+    @property
+    def name(self):
+        return self.memory.name
+    
+    def locked(self, rows):
+        if self.locks is None:
+            return contextlib.nullcontext()
+        
+        stack = contextlib.ExitStack()
+        for stripe in np.unique(np.asarray(rows) % len(self.locks)).tolist():
+            stack.enter_context(self.locks[stripe])
+            
+        return stack
+    
+    def to_sparse(self):
+        """
+        Copies the visited rows into a SparseQTable, e.g. to save them.
+        """
+        
+        index = np.flatnonzero(self.visits.sum(axis = 1))
+        
+        return SparseQTable.from_snapshot(self.actions, (index, self.values[index].copy(), self.visits[index].copy()))
+    
+    def close(self):
+        del self.values, self.visits
+        self.memory.close()
+        
+        if self.owner:
+            self.memory.unlink()
+    
+class MonteCarloAgent(object):
+    """
+    Given the discrete state-action matrix, the agent navigates through the 
+    fields by simulating multiple games. While the matrix is initialized with 
+    all values at zero, Monte Carlo (MC) updates all visited state-action 
+    values after every completed game.
+    
+    q(s,a) = q(s,a) + (alpha) * (R - q(s,a))
+
+    The q-value at state s taking action a is updated dependent on the 
+    achieved reward in this episode R, and the step size parameter alpha. In 
+    order to decide which action to take in a respective state, the 
+    epsilon-greedy form of the algorithm chooses:
+
+    With epsilon probability: Random action
+    With 1-epsilon probability: Action with maximum q-values
+    
+    Optional parameters in agent_init_info:
+        
+        "visit"      -> "first" (default) to learn from the first visit of a 
+                        pair in a simulation only, "every" to learn from all
+        "discount"   -> discount factor gamma, the reward of a pair visited k 
+                        moves before the end counts gamma^k times (default 1)
+        "step_size"  -> may be "sample-average" for a step size of 1/N, with 
+                        N the number of returns the pair has learned from, 
+                        which makes q(s,a) the mean of its returns. With 
+                        first visits, the visit count of a pair only goes up 
+                        once per simulation, so N counts those.
+        "batch_size" -> number of simulations per batch for "on_batch" 
+        "on_batch"   -> called as on_batch(simulations, delta_norm) after every 
+                        batch with the norm of the change of all q-values in 
+                        the batch. Returning True sets converged, which stops 
+                        the Tournament early (see stop_below())
+        "config"     -> GameConfig of the game, the default game otherwise
+        "shared_table" -> name of a SharedQTable to learn in instead of a 
+                        table of its own, with its "locks" if it has any
+        "abstraction" -> learn over the keys of a state abstraction, e.g. 
+                        "runs" (see RunAbstraction), instead of exact states
+    """
+    
+    def agent_init(self, agent_init_info):
+        """
+        Initializes the agent to get parameters and import/create q-tables.
+        Required parameters: agent_init_info as dict
+        """
+        
+        # (1) Store the parameters provided in agent_init_info
+        self.config = agent_init_info.get("config") or GameConfig()
+        self.encoder = self.config.encoder()
+        self.states = self.config.state_space()
+        self.actions = actions()
+        self.abstraction = new_abstraction(agent_init_info.get("abstraction"), self.encoder)
+        self.key = self.abstraction.key
+        
+        # State-action pairs visited in this simulation, in order. A pair is on 
+        # its first visit unless its stamp matches the generation, so starting a 
+        # new simulation only means moving on to the next generation.
+        self.state_seen = np.zeros(64, dtype = np.int64)
+        self.action_seen = np.zeros(64, dtype = np.int64)
+        self.first_seen = np.zeros(64, dtype = bool)
+        self.n_seen = 0
+        self.seen = np.zeros((1024, len(self.actions)), dtype = np.int32)
+        self.generation = 1
+        
+        self.epsilon = agent_init_info["epsilon"]
+        self.step_size = agent_init_info["step_size"]
+        self.every_visit = agent_init_info.get("visit", "first") == "every"
+        self.discount = agent_init_info.get("discount", 1.0)
+        
+        self.batch_size = agent_init_info.get("batch_size", 1000)
+        self.on_batch = agent_init_info.get("on_batch")
+        self.simulations = 0
+        self.batch_delta = 0.0
+        self.converged = False
+        
+        self.tracer = agent_init_info.get("tracer", null_tracer)
+        self.R = reward_table(self.config, self.encoder)
+        
+        if "shared_table" in agent_init_info:
+            self.q = SharedQTable.attach(agent_init_info["shared_table"], len(self.abstraction), self.actions, 
+                                         agent_init_info.get("locks"))
+        elif agent_init_info.get("new_model", True):
+            self.q = SparseQTable(self.actions)
+        else:
+            self.q = SparseQTable.load(agent_init_info["model_path"])
+        
+    def step(self, state_dict, actions_dict):
+        """
+        Choose the optimal next action according to the followed policy.
+        Required parameters:
+            - state_dict as dict
+            - actions_dict as dict
+        """
+        
+        # (1) Transform state into its index
+        state = self.encoder.encode(state_dict)
+        
+        return self.step_index(state, actions_dict)
+    
+    def step_index(self, state, actions_dict):
+        """
+        Same as step() for a state that is already encoded.
+        Required parameters:
+            - state as int
+            - actions_dict as dict
+        """
+        
+        # (1) The table is addressed by the key of the state
+        state = self.key(state)
+        
+        # (2) Choose action using epsilon greedy
+        # (2a) Random action
+        if random.random() < self.epsilon:
+            actions_possible = [key for key,val in actions_dict.items() if val != 0]
+            action = random.choice(actions_possible)
+         
+        # (2b) Greedy action
+        else:
+            action = self.q.argmax(state, actions_dict)
+        
+        # (3) Add state-action pair and whether it is seen first in this simulation. 
+        # The stamps are kept per row of the table, so they grow along with it.
+        a = self.q.action_index[action]
+        row = self.q.row(state)
+        if row >= len(self.seen):
+            seen = np.zeros((max(2 * len(self.seen), row + 1), len(self.actions)), dtype = np.int32)
+            seen[:len(self.seen)] = self.seen
+            self.seen = seen
+            
+        if self.n_seen == len(self.state_seen):
+            self.state_seen = np.concatenate([self.state_seen, np.zeros_like(self.state_seen)])
+            self.action_seen = np.concatenate([self.action_seen, np.zeros_like(self.action_seen)])
+            self.first_seen = np.concatenate([self.first_seen, np.zeros_like(self.first_seen)])
+            
+        self.state_seen[self.n_seen] = state
+        self.action_seen[self.n_seen] = a
+        first = self.seen[row, a] != self.generation
+        self.first_seen[self.n_seen] = first
+        self.seen[row, a] = self.generation
+        self.n_seen += 1
+        
+        # Visits count the returns a pair learns from
+        if first or self.every_visit:
+            self.q.visit(state, action)
+        
+        return action
+    
+    def update(self, state_dict, action):
+        """
+        Updating Q-values according to Belman equation
+        Required parameters:
+            - state_dict as dict
+            - action as str
+        """
+        
+        self.update_index(self.encoder.encode(state_dict), action)
+        
+    def update_index(self, state, action):
+        """
+        Same as update() for a state that is already encoded.
+        Required parameters:
+            - state as int
+            - action as str
+        """
+        
+        reward = self.R.get(state, action)
+        n = self.n_seen
+        
+        # (1) Discounted return of every move, counted back from the end
+        returns = reward * self.discount ** np.arange(n - 1, -1, -1)
+        
+        states = self.state_seen[:n]
+        cols = self.action_seen[:n]
+        if not self.every_visit:
+            first = self.first_seen[:n]
+            states, cols, returns = states[first], cols[first], returns[first]
+        
+        # (2) Update Q-values of all state-action pairs visited in the simulation 
+        # at once. A pair visited k times moves towards the mean of its k returns 
+        # as far as k updates in a row would take it.
+        cells = self.q.rows_for(states) * len(self.actions) + cols
+        
+        if self.every_visit:
+            cells, inverse, counts = np.unique(cells, return_inverse = True, return_counts = True)
+            totals = np.bincount(inverse, weights = returns)
+        else:
+            counts, totals = 1, returns
+        
+        values = self.q.values.reshape(-1)
+        
+        with self.q.locked(cells // len(self.actions)):
+            old = values[cells]
+            
+            if self.step_size == "sample-average":
+                values[cells] += (totals - counts * old) / self.q.visits.reshape(-1)[cells]
+            else:
+                values[cells] += (1 - (1 - self.step_size) ** counts) * (totals / counts - old)
+        
+        if self.tracer.level <= DEBUG:
+            for cell, q in zip(cells.tolist(), values[cells].tolist()):
+                self.tracer.emit(DEBUG, "q_update", state = int(self.q.states_for(cell // len(self.actions))), 
+                                 action = self.actions[cell % len(self.actions)], q = q)
+            
+        self.n_seen = 0
+        self.generation += 1
+        
+        # (3) Report the change of the q-values after every batch of simulations
+        if self.on_batch is not None:
+            self.batch_delta += np.square(values[cells] - old).sum()
+            self.simulations += 1
+            
+            if self.simulations % self.batch_size == 0:
+                if self.on_batch(self.simulations, math.sqrt(self.batch_delta)):
+                    self.converged = True
+                self.batch_delta = 0.0
+        
+        
+class ReplayBuffer(object):
+    """
+    Ring buffer of the last capacity transitions (state, action, reward, next 
+    state, next state allows passing, done) of an agent, held in one NumPy 
+    array per field. States are given by their row in the agent's table, 
+    which never changes once a state has one, so sampled transitions index 
+    the table directly. Once full, every new transition overwrites the 
+    oldest one.
+    """
+    
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.states = np.zeros(capacity, dtype = np.int64)
+        self.actions = np.zeros(capacity, dtype = np.int64)
+        self.rewards = np.zeros(capacity)
+        self.next_states = np.zeros(capacity, dtype = np.int64)
+        self.next_pass = np.zeros(capacity, dtype = bool)
+        self.done = np.zeros(capacity, dtype = bool)
+        self.n = 0
+        self.position = 0
+        
+    def __len__(self):
+        return self.n
+    
+    def add(self, state, action, reward, next_state, next_pass, done):
+        i = self.position
+        self.states[i] = state
+        self.actions[i] = action
+        self.rewards[i] = reward
+        self.next_states[i] = next_state
+        self.next_pass[i] = next_pass
+        self.done[i] = done
+        
+        self.position = (i + 1) % self.capacity
+        self.n = min(self.n + 1, self.capacity)
+        
+    def sample(self, size, rng):
+        """
+        Returns a minibatch of size transitions drawn uniformly with 
+        replacement, as a tuple of arrays in the order of add().
+        """
+        
+        i = rng.integers(0, self.n, size)
+        
+        return self.states[i], self.actions[i], self.rewards[i], self.next_states[i], self.next_pass[i], self.done[i]
+    
+class QLearningAgent(object):
+    """
+    In its basic form, Q-learning works in a similar way. However, while MC 
+    waits for the completion of each episode before updating q-values, 
+    Q-learning updates them with a lag of one step, at each step.
+    
+    q(s,a) = q(s,a) + (alpha) * (r + q(s-hat,a-hat) - q(s,a))
+    
+    The q-value is thereby dependent on the step-size parameter, the reward of 
+    the next step r, and the q-value of the next step at state s-hat and 
+    action-hat.
+
+    Both algorithms consequently take the same 2 parameters which have the 
+    following effects:
+
+    Alpha: A higher step size parameter increases the change in q-values at 
+    each update while prohibiting values to converge closer to their true 
+    optimum.
+    
+    Epsilon: A higher epsilon grants more exploration of actions, which do not
+    appear profitable at first sight. At the same time, this dilutes the 
+    optimal game strategy when it has been picked up by the agent.
+    
+    The game is given by a GameConfig under "config" in agent_init_info, 
+    the default game otherwise.
+    
+    With "replay" set to a capacity in agent_init_info, the agent learns off 
+    policy from a ReplayBuffer instead. Every move is stored as a transition 
+    with reward 0, the last move of a game as a terminal transition with the 
+    final score (see agent_end()), and after every move the agent samples 
+    minibatches and updates them all at once:
+    
+    q(s,a) = q(s,a) + (alpha) * (r + gamma * max q(s',a') - q(s,a))
+    
+    where the max only runs over the legal actions of s' and is left out at 
+    terminal transitions. New rows of the table start at the rewards of their 
+    state, the score if the game ended with that move, rather than at zero. 
+    Further optional parameters:
+        
+        "replay_batch"   -> transitions per minibatch (default 32)
+        "replay_updates" -> minibatches per move (default 1)
+        "discount"       -> gamma (default 1)
+        "seed"           -> seed of the sampling
+        
+    Without replay, the final score can also be spread back over the moves of 
+    a game in one vectorized pass over the moves so far:
+        
+        "n_step" -> n-step Q-learning, a move is updated n moves later 
+                    towards gamma^n max q(s',a') of the state reached then, 
+                    the last n moves towards the final score when the game 
+                    ends
+        "lambda" -> Watkins's Q(lambda) with accumulating traces, every 
+                    update of a move also updates the moves before it with 
+                    the weight (gamma * lambda)^k, k moves back. An 
+                    exploratory move cuts the traces.
+                    
+    n_step = 1 and lambda = 0 give one-step Q-learning on the final score. 
+    Larger values carry the score back faster at the cost of more variance.
+    
+    Like MonteCarloAgent, the agent learns in a SharedQTable if 
+    "shared_table" gives its name, and over the keys of a state abstraction 
+    if "abstraction" gives one. Rewards always come from the exact state. 
+    New rows only start at the rewards with the exact abstraction, an 
+    abstract key has no rewards of its own.
+    """
+    
+    def agent_init(self, agent_init_info):
+        """
+        Initializes the agent to get parameters and import/create q-tables.
+        Required parameters: agent_init_info as dict
+        """
+        
+        # (1) Store the parameters provided in agent_init_info
+        self.config = agent_init_info.get("config") or GameConfig()
+        self.encoder = self.config.encoder()
+        self.states = self.config.state_space()
+        self.actions = actions()
+        self.abstraction = new_abstraction(agent_init_info.get("abstraction"), self.encoder)
+        self.key = self.abstraction.key
+        self.prev_state = None
+        self.prev_action = None
+        self.converged = False
+        
+        self.epsilon = agent_init_info["epsilon"]
+        self.step_size = agent_init_info["step_size"]
+        self.tracer = agent_init_info.get("tracer", null_tracer)
+        self.R = reward_table(self.config, self.encoder)
+        
+        self.replay = None
+        if agent_init_info.get("replay"):
+            self.replay = ReplayBuffer(agent_init_info["replay"])
+            self.replay_batch = agent_init_info.get("replay_batch", 32)
+            self.replay_updates = agent_init_info.get("replay_updates", 1)
+            self.discount = agent_init_info.get("discount", 1.0)
+            self.rng = np.random.default_rng(agent_init_info.get("seed"))
+            
+        # Moves of the current game for n-step returns and traces
+        self.n_step = agent_init_info.get("n_step")
+        self.trace_decay = agent_init_info.get("lambda")
+        self.traces = self.replay is None and (self.n_step is not None or self.trace_decay is not None)
+        if self.traces:
+            self.discount = agent_init_info.get("discount", 1.0)
+            self.episode_rows = np.zeros(64, dtype = np.int64)
+            self.episode_actions = np.zeros(64, dtype = np.int64)
+            self.n_episode = 0
+        
+        # Learning from the final score, values start at the rewards of a state
+        terminal = (self.replay is not None or self.traces) and self.abstraction.exact
+        if "shared_table" in agent_init_info:
+            self.q = SharedQTable.attach(agent_init_info["shared_table"], len(self.abstraction), self.actions, 
+                                         agent_init_info.get("locks"))
+        elif agent_init_info.get("new_model", True):
+            self.q = SparseQTable(self.actions, init = self.reward_row if terminal else None)
+        else:
+            self.q = SparseQTable.load(agent_init_info["model_path"])
+            self.q.init = self.reward_row if terminal else None
+        
+    def reward_row(self, state):
+        # row() may grow a sparse reward table, so values are read after it
+        row = self.R.row(state)
+        
+        return self.R.values[row]
+        
+    def step(self, state_dict, actions_dict):
+        """
+        Choose the optimal next action according to the followed policy.
+        Required parameters:
+            - state_dict as dict
+            - actions_dict as dict
+        """
+        
+        # (1) Transform state into its index
+        state = self.encoder.encode(state_dict)
+        
+        return self.step_index(state, actions_dict)
+    
+    def step_index(self, state, actions_dict):
+        """
+        Same as step() for a state that is already encoded.
+        Required parameters:
+            - state as int
+            - actions_dict as dict
+        """
+        
+        # (2) Choose action using epsilon greedy
+        # (2a) Random action
+        if random.random() < self.epsilon:
+            actions_possible = [key for key,val in actions_dict.items() if val != 0]
+            action = random.choice(actions_possible)
+         
+        # (2b) Greedy action
+        else:
+            action = self.q.argmax(self.key(state), actions_dict)
+        
+        return action
+  
+    def update(self, state_dict, action):
+        """
+        Updating Q-values according to Belman equation
+        Required parameters:
+            - state_dict as dict
+            - action as str
+        """
+        self.update_index(self.encoder.encode(state_dict), action)
+        
+    def update_index(self, state, action):
+        """
+        Same as update() for a state that is already encoded.
+        Required parameters:
+            - state as int
+            - action as str
+        """
+        
+        # The table is addressed by the key of the state, the rewards by the state
+        key = self.key(state)
+        
+        if self.replay is not None:
+            return self.replay_index(state, key, action)
+        if self.traces:
+            return self.trace_index(state, key, action)
+        
+        # (1) Set prev_state unless first turn
+        if self.prev_state is not None:
+            with self.q.locked(self.q.row(self.prev_state)):
+                prev_q = self.q.get(self.prev_state, self.prev_action)
+                this_q = self.q.get(key, action)
+                reward = self.R.get(state, action)
+                
+                # Calculate new Q-values
+                if reward == 0:
+                    self.q.set(self.prev_state, self.prev_action, prev_q + self.step_size * (reward + this_q - prev_q))
+                else:
+                    self.q.set(self.prev_state, self.prev_action, prev_q + self.step_size * (reward - prev_q))
+            
+                self.q.visit(self.prev_state, self.prev_action)
+        
+        # (2) Save and return action/state
+        self.prev_state = key
+        self.prev_action = action
+        
+    def agent_end(self, reward):
+        """
+        Called by the game once it is over, with the final score of the agent. 
+        Stores the last move as a terminal transition when learning from 
+        replay, the one-step updates ignore it.
+        """
+        
+        if self.replay is not None and self.prev_state is not None:
+            self.replay.add(self.q.row(self.prev_state), self.q.action_index[self.prev_action], reward, 0, False, True)
+            self.prev_state = None
+            self.learn_replay()
+            
+        if self.traces and self.n_episode:
+            self.learn_traces(reward, end = True)
+            self.n_episode = 0
+            
+    def trace_index(self, state, key, action):
+        """
+        Updates the earlier moves of the game from the value of this state and 
+        adds this move to them.
+        """
+        
+        row = self.q.row(key)
+        a = self.q.action_index[action]
+        
+        if self.n_episode:
+            values = self.q.values[row]
+            can_pass = self.encoder.player_chips(state) > 0
+            best = values.max() if can_pass else values[self.q.action_index["take"]]
+            self.learn_traces(self.discount * best)
+            
+            # Watkins: the traces end where the agent did not act greedily
+            if self.trace_decay is not None and values[a] != best:
+                self.n_episode = 0
+                
+        if self.n_episode == len(self.episode_rows):
+            self.episode_rows = np.concatenate([self.episode_rows, np.zeros_like(self.episode_rows)])
+            self.episode_actions = np.concatenate([self.episode_actions, np.zeros_like(self.episode_actions)])
+            
+        self.episode_rows[self.n_episode] = row
+        self.episode_actions[self.n_episode] = a
+        self.n_episode += 1
+        self.q.visits[row, a] += 1
+        
+    def learn_traces(self, target, end = False):
+        """
+        Updates the moves of the game so far. target is the discounted value 
+        of the state after the last move, or with end the final score.
+        """
+        
+        n = self.n_episode
+        back = np.arange(n - 1, -1, -1)
+        rows = self.episode_rows[:n]
+        cols = self.episode_actions[:n]
+        values = self.q.values
+        
+        if self.n_step is not None:
+            # A move is due n moves later, at the end all moves still open are
+            if end:
+                due = slice(max(0, n - self.n_step), n)
+            elif n >= self.n_step:
+                due = slice(n - self.n_step, n - self.n_step + 1)
+            else:
+                return
+            
+            rows, cols, back = rows[due], cols[due], back[due]
+            with self.q.locked(rows):
+                values[rows, cols] += self.step_size * (target * self.discount ** back - values[rows, cols])
+        else:
+            with self.q.locked(rows):
+                delta = target - values[rows[-1], cols[-1]]
+                np.add.at(values, (rows, cols), self.step_size * delta * (self.discount * self.trace_decay) ** back)
+            
+    def replay_index(self, state, key, action):
+        """
+        Stores the transition from the previous move to this one and learns 
+        from the replay buffer.
+        """
+        
+        if self.prev_state is not None:
+            can_pass = self.encoder.player_chips(state) > 0
+            self.replay.add(self.q.row(self.prev_state), self.q.action_index[self.prev_action], 0.0, 
+                            self.q.row(key), can_pass, False)
+            self.learn_replay()
+            
+        self.q.visit(key, action)
+        self.prev_state = key
+        self.prev_action = action
+        
+    def learn_replay(self):
+        """
+        Applies replay_updates minibatch updates from the replay buffer.
+        """
+        
+        take = self.q.action_index["take"]
+        n_actions = len(self.actions)
+        
+        for i in range(self.replay_updates):
+            rows, actions, rewards, next_rows, next_pass, done = self.replay.sample(self.replay_batch, self.rng)
+            values = self.q.values
+            
+            # The next state only counts where the game goes on, and passing only 
+            # where the player has chips left
+            next_values = values[next_rows]
+            best = np.where(next_pass, next_values.max(axis = 1), next_values[:, take])
+            targets = np.where(done, rewards, rewards + self.discount * best)
+            
+            # The minibatch is drawn with replacement. A pair drawn k times moves 
+            # towards the mean of its targets as far as k updates in a row would 
+            # take it, like in MonteCarloAgent.update_index()
+            cells, inverse, counts = np.unique(rows * n_actions + actions, return_inverse = True, return_counts = True)
+            targets = np.bincount(inverse, weights = targets) / counts
+            values = values.reshape(-1)
+            
+            with self.q.locked(cells // n_actions):
+                values[cells] += (1 - (1 - self.step_size) ** counts) * (targets - values[cells])
+
+class LinearQ(object):
+    """
+    Linear q-function over a small feature vector: one weight vector per 
+    action, q(s,a) = w[a] . features(s). Its size does not depend on the 
+    deck, so it replaces the table when the state space is too large to 
+    enumerate.
+    """
+    
+    def __init__(self, actions, n_features, weights = None):
+        self.actions = list(actions)
+        self.action_index = {action: i for i, action in enumerate(self.actions)}
+        
+        if weights is None:
+            weights = np.zeros((len(self.actions), n_features))
+            
+        self.weights = np.asarray(weights, dtype = np.float64)
+        
+    def save(self, path):
+        os.makedirs(path, exist_ok = True)
+        np.save(os.path.join(path, "weights.npy"), self.weights)
+        np.save(os.path.join(path, "actions.npy"), np.array(self.actions))
+        
+    @classmethod
+    def load(cls, path):
+        arrays = load_arrays(path)
+        
+        return cls(arrays["actions"].tolist(), arrays["weights"].shape[1], arrays["weights"])
+    
+    def values(self, features):
+        """
+        Returns the q-values of all actions for one feature vector.
+        """
+        
+        return self.weights @ features
+    
+class LinearAgent(object):
+    """
+    Monte Carlo control with a linear q-function (see LinearQ) instead of a 
+    table. A state is described by a handful of features that mean the same 
+    for any deck:
+        
+        - a constant
+        - the open card, the chips on it and the chips of the player, scaled 
+          by the highest card
+        - whether the cards right below and right above the open card are 
+          in the hand, i.e. whether taking it extends a run
+        - the change of the score when taking the card, chips included
+        - the number of cards in the hand, which tells how far the game is
+        
+    The cards left in the deck are not part of the state the engine hands 
+    over, the size of the hand stands in for them.
+    
+    The agent plays epsilon-greedy. Every move of a game is remembered and 
+    when the game ends its features are regressed towards the final score 
+    in one batched gradient step over the last batch_size games:
+        
+    w[a] = w[a] + (alpha) * mean((G - w[a] . x) * x)
+    
+    Optional parameters in agent_init_info:
         
-        if deck.check_end() != True:
-            player.draw_card_rand(deck, player)
+        "batch_size" -> games per gradient step (default 16)
+        "config"     -> GameConfig of the game, the default game otherwise
+    """
+    
+    n_features = 8
+    
+    def agent_init(self, agent_init_info):
+        """
+        Initializes the agent to get parameters and import/create weights.
+        Required parameters: agent_init_info as dict
+        """
+        
+        self.config = agent_init_info.get("config") or GameConfig()
+        self.encoder = self.config.encoder()
+        self.actions = actions()
+        self.scale = 1.0 / self.encoder.cards[-1]
+        self.converged = False
+        
+        self.epsilon = agent_init_info["epsilon"]
+        self.step_size = agent_init_info["step_size"]
+        self.batch_size = agent_init_info.get("batch_size", 16)
+        self.tracer = agent_init_info.get("tracer", null_tracer)
+        
+        # Moves of the current batch of games and where the current game starts
+        self.batch_features = list()
+        self.batch_actions = list()
+        self.batch_returns = list()
+        self.game_start = 0
+        self.games = 0
+        
+        if agent_init_info.get("new_model", True):
+            self.q = LinearQ(self.actions, self.n_features)
+        else:
+            self.q = LinearQ.load(agent_init_info["model_path"])
             
-    def take_card_agent(self, player, deck):
-        global card_pool
-        global chip_pool
+    def features(self, state):
+        """
+        Returns the feature vector of an encoded state.
+        """
+        
+        open_card, pool, chips, mask = self.encoder.decode_parts(state)
+        card = -open_card
+        bit = card - self.encoder.low
         
-        self.card_hand.append(-card_pool)
-        self.card_hand.sort(reverse=True)
+        below = bit > 0 and mask >> (bit - 1) & 1
+        above = mask >> (bit + 1) & 1
+        gain = pool + self.config.hand_score(mask | 1 << bit) - self.config.hand_score(mask)
+        
+        return np.array([1.0, card * self.scale, pool * self.scale, chips * self.scale, 
+                         below, above, gain * self.scale, self.encoder.hand_size(mask) * self.scale])
+    
+    def features_of(self, states):
+        """
+        Same as features() for an array of encoded states, one row per state.
+        """
         
-        while len(self.card_hand) > 6:
-            self.card_hand.remove(self.card_hand[0])
-        self.chip_hand += chip_pool
+        encoder = self.encoder
+        open_card, pool, chips, mask = encoder.decode_parts(np.asarray(states, dtype = np.int64))
+        card = -open_card
+        bit = card - encoder.low
         
-        chip_pool = 0
+        gain = pool + run_scores(mask | 1 << bit, encoder.cards) - run_scores(mask, encoder.cards)
         
-        if algorithm == "q-learning":
-            agent.update(self.state, self.action)
+        return np.column_stack([np.ones(len(card)), card * self.scale, pool * self.scale, chips * self.scale, 
+                                (mask << 1) >> bit & 1, mask >> (bit + 1) & 1, gain * self.scale, 
+                                encoder.hand_size(mask) * self.scale])
+    
+    def step(self, state_dict, actions_dict):
+        """
+        Choose the optimal next action according to the followed policy.
+        Required parameters:
+            - state_dict as dict
+            - actions_dict as dict
+        """
         
-        if deck.check_end() != True:
-            player.draw_card_agent(deck, player)
+        return self.step_index(self.encoder.encode(state_dict), actions_dict)
+    
+    def step_index(self, state, actions_dict):
+        """
+        Same as step() for a state that is already encoded.
+        Required parameters:
+            - state as int
+            - actions_dict as dict
+        """
         
-    def pass_card(self):
-        global card_pool
-        global chip_pool
+        features = self.features(state)
+        actions_possible = [key for key,val in actions_dict.items() if val != 0]
         
-        self.chip_hand -= 1
-        chip_pool += 1
+        if random.random() < self.epsilon or len(actions_possible) == 1:
+            action = random.choice(actions_possible)
+        else:
+            values = self.q.values(features)
+            val_max = max(values[self.q.action_index[i]] for i in actions_possible)
+            action = random.choice([i for i in actions_possible if values[self.q.action_index[i]] == val_max])
+            
+        self.batch_features.append(features)
+        self.batch_actions.append(self.q.action_index[action])
         
-    def identify_state(self):
+        return action
     
-        while len(self.card_hand) < 6:
-            self.card_hand.insert(0,0)
+    def update(self, state_dict, action):
+        """
+        Learns from a finished game, given the last move of the agent.
+        Required parameters:
+            - state_dict as dict
+            - action as str
+        """
+        
+        self.update_index(self.encoder.encode(state_dict), action)
+        
+    def update_index(self, state, action):
+        """
+        Same as update() for a state that is already encoded.
+        Required parameters:
+            - state as int
+            - action as str
+        """
+        
+        # (1) The final score follows from the last move, as in reward_matrix()
+        reward = self.config.state_rewards(self.encoder, state)[self.q.action_index[action]]
             
-        state = [-card_pool, chip_pool, self.chip_hand, self.card_hand]
+        n = len(self.batch_features) - self.game_start
+        self.batch_returns.extend([reward] * n)
+        self.game_start = len(self.batch_features)
+        self.games += 1
         
-        self.state = []
-        for i in state:
-            if type(i) == list:
-                for j in i:
-                    self.state.append(j)
-            else:
-                self.state.append(i)
+        if self.games % self.batch_size != 0:
+            return
+        
+        # (2) One gradient step on all moves of the batch
+        X = np.array(self.batch_features)
+        a = np.array(self.batch_actions)
+        G = np.array(self.batch_returns, dtype = np.float64)
+        
+        error = G - (self.q.weights[a] * X).sum(axis = 1)
+        gradient = np.zeros_like(self.q.weights)
+        np.add.at(gradient, a, error[:, None] * X)
+        self.q.weights += self.step_size * gradient / len(G)
+        
+        if self.tracer.level <= DEBUG:
+            self.tracer.emit(DEBUG, "sgd_update", games = self.games, loss = float(np.square(error).mean()))
         
-    def identify_action(self):
+        self.batch_features = list()
+        self.batch_actions = list()
+        self.batch_returns = list()
+        self.game_start = 0
 
-        if self.chip_hand == 0:
-            self.actions = {"take":1,"pass":0}
+class Policy(object):
+    """
+    Frozen greedy policy of a trained agent, for playing without learning. 
+    The greedy action of every state of the encoder is worked out once and 
+    kept as one byte per state, 0 to take and 1 to pass like the opponent 
+    policies, so act() is a single index into a bytes object with no 
+    epsilon, no tie break and no table lookup.
+    
+    Ties, including states the agent never visited, go to "take", and so do 
+    all states without chips, where passing is not allowed. save() stores one 
+    bit per state in a compressed .npz file of a few kilobytes.
+    
+    A Policy can stand in for the agent of a GameEngine, it just never learns. 
+    It holds a byte for every state of the encoder, so it is meant for 
+    encoders of up to max_states states. See SnapshotOpponent for larger 
+    games.
+    """
+    
+    max_states = 2 ** 24
+    
+    def __init__(self, table, encoder = None):
+        self.encoder = encoder if encoder is not None else StateEncoder()
+        self.actions = actions()
+        self.table = bytes(table)
+        self.tracer = null_tracer
+        self.converged = False
+        
+    @classmethod
+    def from_table(cls, q, encoder = None, abstraction = None):
+        """
+        Freezes the greedy actions of a QTable or SparseQTable over the index 
+        of encoder. A table learned over the keys of an abstraction is 
+        expanded back to every state of the encoder.
+        """
+        
+        encoder = encoder if encoder is not None else StateEncoder()
+        abstraction = abstraction if abstraction is not None else ExactAbstraction(encoder)
+        greedy = np.zeros(len(abstraction), dtype = np.uint8)
+        
+        if isinstance(q, SparseQTable):
+            n = len(q)
+            states, values = q.index[:n], q.values[:n]
         else:
-            self.actions = {"take":1,"pass":1}
+            states, values = np.arange(len(q)), q.values
+            
+        greedy[states] = values[:, q.action_index["pass"]] > values[:, q.action_index["take"]]
+        table = greedy if abstraction.exact else greedy[abstraction.keys(np.arange(len(encoder)))]
+        
+        # Without chips the only move is to take
+        table[encoder.player_chips(np.arange(len(encoder))) == 0] = 0
+        
+        return cls(table, encoder)
+    
+    @classmethod
+    def from_linear(cls, agent):
+        """
+        Freezes the greedy actions of a LinearAgent over the index of its 
+        encoder.
+        """
         
-    def play_agent(self, player, deck):
+        encoder = agent.encoder
+        table = np.zeros(len(encoder), dtype = np.uint8)
         
-        self.identify_state()
-        self.identify_action()
+        # The features of all states at once would take 8 floats per state
+        for start in range(0, len(encoder), 2 ** 18):
+            values = agent.features_of(np.arange(start, min(start + 2 ** 18, len(encoder)))) @ agent.q.weights.T
+            table[start:start + len(values)] = values[:, agent.q.action_index["pass"]] > values[:, agent.q.action_index["take"]]
         
-        self.action = agent.step(self.state, self.actions)
+        # Without chips the only move is to take
+        table[encoder.player_chips(np.arange(len(encoder))) == 0] = 0
         
-        if self.action == "take":
-            player.take_card_agent(player, deck)
-            
-        else:  
-            if algorithm == "q-learning":
-                agent.update(self.state, self.action)
-                
-            player.pass_card() 
+        return cls(table, encoder)
+    
+    @classmethod
+    def from_agent(cls, agent):
+        if isinstance(agent.q, LinearQ):
+            return cls.from_linear(agent)
         
-    def rand_play(self, player, deck):
+        return cls.from_table(agent.q, agent.encoder, agent.abstraction)
+    
+    def save(self, path):
         """
-        Action is randomly determined. Note that players must take a card if
-        they are out of chips.
+        Writes the policy to the .npz file path.
         """
-        global chip_pool
-        decision = random.randint(0,1)
         
-        if self.chip_hand == 0:
-            decision = 0
+        np.savez_compressed(path, bits = np.packbits(np.frombuffer(self.table, dtype = np.uint8)),
+                            cards = np.array(self.encoder.cards), max_chips = self.encoder.n_chips - 1)
         
-        if decision == 0:
-            player.take_card_rand(player, deck)
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as arrays:
+            encoder = StateEncoder(arrays["cards"].tolist(), int(arrays["max_chips"]))
+            table = np.unpackbits(arrays["bits"], count = len(encoder))
             
-        if decision == 1:
-            player.pass_card()
-            
-    def point_tally(self):
+            return cls(table, encoder)
+        
+    def act(self, state):
         """
-        Calculates the total number of points a player currently has.
+        Returns 0 to take or 1 to pass at the given state index.
         """
         
-        card_points = card_point_tally(self.card_hand)
-        chip_points = self.chip_hand
-        return card_points + chip_points
+        return self.table[state]
     
+    def step(self, state_dict, actions_dict):
+        return self.step_index(self.encoder.encode(state_dict), actions_dict)
+    
+    def step_index(self, state, actions_dict):
+        return self.actions[self.table[state]]
+    
+    def update(self, state_dict, action):
+        pass
     
-# 5. Game
+    def update_index(self, state, action):
+        pass
+    
+    def agent_end(self, reward):
+        pass
+
+# 3. Opponents
 # ----------------------------------------------------------------------------
 
-class Game(object):
+def rand_play(game, seat):
+    """
+    Action is randomly determined: 0 to take the open card, 1 to pass it. The 
+    game makes players take the card if they are out of chips.
+    """
+    
+    return game.rng.randint(0,1)
+
+class Opponent(object):
+    """
+    Base class of the opponent plug-ins. An opponent decides for a whole batch 
+    of games at once: act(states) is given the encoded states of the seat to 
+    move as an int array and returns an array with 0 to take and 1 to pass, 
+    so a VectorSimulator can play thousands of games with one call per seat 
+    and turn.
+    
+    An opponent is also a policy for GameEngine, calling it as 
+    opponent(game, seat) encodes the state of the seat and acts on it alone. 
+    act() is written with plain operators, so it takes a single int state as 
+    well and the engine does not pay for building arrays.
+    
+    Subclasses implement act(). States are decoded with the encoder of the 
+    config, the default game if none is given.
+    """
+    
+    def __init__(self, config = None):
+        self.config = config if config is not None else GameConfig()
+        self.encoder = self.config.encoder()
+        
+    def __call__(self, game, seat):
+        return int(self.act(self.encoder.encode_parts(-game.card, game.pool, game.chips[seat], game.hands[seat])))
     
-   def __init__(self, player_1, player_2, player_3):
+    def decode(self, states):
         """
-        A game reflects an iteration of turns, until the deck emtpies and total
-        points are tallied. Winner is then determined. Initialised with three
-        players.
+        Returns the open card, the chips on it, the chips and the hand bitmask 
+        of the player. Cards are positive.
         """
+        
+        open_card, pool, chips, hand = self.encoder.decode_parts(states)
+        
+        return -open_card, pool, chips, hand
+    
+    def act(self, states):
+        raise NotImplementedError
+    
+class RandomOpponent(Opponent):
+    """
+    Passes with probability p_pass, like rand_play() for p_pass = 0.5. In a 
+    GameEngine it draws from the random generator of the game, so seeding 
+    the game seeds the opponent too.
+    """
+    
+    def __init__(self, p_pass = 0.5, seed = None, config = None):
+        super().__init__(config)
+        self.p_pass = p_pass
+        self.rng = np.random.default_rng(seed)
+        
+    def __call__(self, game, seat):
+        return int(game.rng.random() < self.p_pass)
+        
+    def act(self, states):
+        return (self.rng.random(len(states)) < self.p_pass) * 1
+    
+class ThresholdOpponent(Opponent):
+    """
+    Takes a card once the chips on it reach threshold chips per point of the 
+    card, e.g. 5 chips on a 10 for the default 0.5, and passes otherwise.
+    """
+    
+    def __init__(self, threshold = 0.5, config = None):
+        super().__init__(config)
+        self.threshold = threshold
+        
+    def act(self, states):
+        card, pool, chips, hand = self.decode(states)
+        
+        return 1 * (pool < self.threshold * card) * (chips > 0)
+    
+class RunOpponent(ThresholdOpponent):
+    """
+    Takes every card that extends a run of its hand, i.e. whose neighbour 
+    below or above it holds, and otherwise plays like ThresholdOpponent.
+    """
+    
+    def act(self, states):
+        card, pool, chips, hand = self.decode(states)
+        bit = card - self.encoder.low
+        
+        # Bit i of hand << 1 stands for the card right below card i
+        neighbour = ((hand << 1 | hand >> 1) >> bit) & 1
+        
+        return 1 * (neighbour == 0) * (pool < self.threshold * card) * (chips > 0)
+    
+class PolicyOpponent(Opponent):
+    """
+    Plays a frozen Policy, e.g. a snapshot of the agent for self-play:
+        
+        PolicyOpponent(Policy.from_agent(agent))
+        
+    The policy has to use the encoder of the config.
+    """
+    
+    def __init__(self, policy, config = None):
+        super().__init__(config)
+        self.policy = policy
+        self.table = np.frombuffer(policy.table, dtype = np.uint8)
+        
+    def act(self, states):
+        return self.table[states]
+    
+class SnapshotOpponent(Opponent):
+    """
+    Plays the greedy actions of a frozen copy of the table or the weights of 
+    an agent, like PolicyOpponent(Policy.from_agent(agent)). The actions are 
+    worked out when a state comes up instead of for every state of the 
+    encoder, so it works for games too large for a Policy.
+    
+    A tabular agent is frozen as the keys of its table where passing is 
+    greedy. Ties, states the agent never visited and states without chips 
+    go to "take". A linear agent keeps a copy of its weights.
+    """
     
-        self.player_1 = Player(player_1)
-        self.player_2 = Player(player_2)
-        self.player_3 = Player(player_3)
+    def __init__(self, agent, config = None):
+        super().__init__(config if config is not None else agent.config)
+        
+        if isinstance(agent.q, LinearQ):
+            self.features = agent.features
+            self.features_of = agent.features_of
+            self.weights = agent.q.weights.copy()
+            self.take, self.pass_ = agent.q.action_index["take"], agent.q.action_index["pass"]
+            self.passes = None
+        else:
+            n = len(agent.q)
+            index, values = agent.q.states_for(np.arange(n)), agent.q.values[:n]
+            self.key, self.keys = agent.abstraction.key, agent.abstraction.keys
+            self.pass_keys = np.sort(index[values[:, agent.q.action_index["pass"]] > values[:, agent.q.action_index["take"]]])
+            self.passes = set(self.pass_keys.tolist())
+            
+    def __call__(self, game, seat):
+        if game.chips[seat] == 0:
+            return 0
+        
+        state = self.encoder.encode_parts(-game.card, game.pool, game.chips[seat], game.hands[seat])
+        if self.passes is not None:
+            return int(self.key(state) in self.passes)
+        
+        values = self.weights @ self.features(state)
+        
+        return int(values[self.pass_] > values[self.take])
+    
+    def act(self, states):
+        states = np.asarray(states, dtype = np.int64)
+        card, pool, chips, hand = self.decode(states)
+        
+        if self.passes is not None:
+            greedy = np.isin(self.keys(states), self.pass_keys)
+        else:
+            values = self.features_of(states) @ self.weights.T
+            greedy = values[:, self.pass_] > values[:, self.take]
+        
+        return 1 * greedy * (chips > 0)
+
+# 4. Game
+# ----------------------------------------------------------------------------
+
+GameResult = namedtuple("GameResult", ["scores", "winner", "turns", "chips", "hands"])
+
+class GameEngine(object):
+    """
+    A game reflects an iteration of turns, until the deck emtpies and total
+    points are tallied. Winner is then determined.
+    
+    The engine keeps the whole game in its own slots and plays the turns in a 
+    flat loop, so it can be reused for any number of games and run side by 
+    side with other engines. The deck is shuffled in place, hands are held as 
+    bitmasks and the agent is handed encoded states, so a game allocates 
+    nothing but its result.
     
-        deck = Deck()
-        deck.build()
-        turn_no = 1
-        global card_pool
-        global chip_pool 
+    The agent always sits in the last seat, the other seats are played by the 
+    given policies, rand_play() for every other player of the config by 
+    default. A policy is called as policy(game, seat) and returns 0 to take 
+    or 1 to pass, like rand_play(). The rules are:
+        
+        - the deck of the GameConfig is shuffled and its removed cards are 
+          left out, in the default game 6 of the cards 3-11 are dealt
+        - each player starts with the chips of the config, 3 by default
+        - a player who takes a card keeps the chips on it and draws the next 
+          card, a player who passes puts a chip on the card
+        - a player out of chips has to take
+        - the game ends as soon as the deck is empty after a move
+    
+    Moves are traced at DEBUG and results at INFO level of the tracer, which 
+    records nothing by default.
+    
+    Required parameters:
+        - agent as MonteCarloAgent or QLearningAgent, after agent_init()
+    """
+    
+    __slots__ = ("agent", "algorithm", "policies", "rng", "tracer", "config", "encoder", "cards", "low", 
+                 "n_draw", "n_players", "card", "pool", "chips", "hands", "seat", "turns")
+    
+    take_only = {"take":1,"pass":0}
+    take_or_pass = {"take":1,"pass":1}
+    
+    def __init__(self, agent, algorithm = "monte-carlo", policies = None, rng = random, tracer = null_tracer, config = None):
+        self.config = config if config is not None else GameConfig()
+        
+        if policies is None:
+            policies = [rand_play] * (self.config.players - 1)
+        if len(policies) != self.config.players - 1:
+            raise ValueError(f'{self.config.players} players need {self.config.players - 1} policies, got {len(policies)}.')
+        
+        self.agent = agent
+        self.algorithm = algorithm
+        self.policies = list(policies) + [None]
+        self.rng = rng
+        self.tracer = tracer
+        self.encoder = agent.encoder
+        
+        self.cards = list(self.config.cards)
+        self.low = self.config.low
+        self.n_draw = self.config.n_draw
+        self.n_players = self.config.players
+        
+        self.card = 0
+        self.pool = 0
+        self.chips = [self.config.chips] * self.n_players
+        self.hands = [0] * self.n_players
+        self.seat = 0
+        self.turns = 0
+        
+    def play(self):
         """
-        Global used as card_pool and chip_pool need to be updated each turn so
-        cannot be reset between function calls.
+        Plays one game and returns its GameResult.
         """
-        card_pool = 0
-        chip_pool = 0
         
-        self.player_1.draw_card_rand(deck, self.player_1)
+        agent = self.agent
+        agent_seat = self.n_players - 1
+        online = self.algorithm == "q-learning"
+        last_state = None
+        tracer = self.tracer
+        tracer.begin_game()
         
-        while deck.check_end() != True:
-            turn_no += 1
+        cards = self.cards
+        chips = self.chips
+        hands = self.hands
+        
+        self.rng.shuffle(cards)
+        for i in range(self.n_players):
+            chips[i] = self.config.chips
+            hands[i] = 0
+        
+        self.card = cards[0]
+        self.pool = 0
+        self.seat = 0
+        self.turns = 0
+        top = 1
+        
+        while True:
+            seat = self.seat
+            self.turns += 1
             
-            if turn_no % 3 == 1:
-                self.player_1.rand_play(self.player_1, deck)
+            if seat == agent_seat:
+                state = self.encoder.encode_parts(-self.card, self.pool, chips[seat], hands[seat])
+                action = agent.step_index(state, self.take_only if chips[seat] == 0 else self.take_or_pass)
+                
+                if online:
+                    agent.update_index(state, action)
+                    
+                last_state, last_action = state, action
+                take = action == "take"
+            else:
+                take = chips[seat] == 0 or self.policies[seat](self, seat) == 0
                 
-            if turn_no % 3 == 2:
-                self.player_2.rand_play(self.player_2, deck)
+            if tracer.level <= DEBUG:
+                tracer.emit(DEBUG, "move", seat = seat, card = self.card, pool = self.pool, chips = chips[seat], take = take)
                 
-            if turn_no % 3 == 0:
-                self.player_3.play_agent(self.player_3, deck)
-        
+            if take:
+                hands[seat] |= 1 << (self.card - self.low)
+                chips[seat] += self.pool
+                self.pool = 0
+                
+                if top == self.n_draw:
+                    break
+                
+                self.card = cards[top]
+                top += 1
+            else:
+                chips[seat] -= 1
+                self.pool += 1
+                
+                if top == self.n_draw:
+                    break
+                
+                self.seat = (seat + 1) % self.n_players
         
-        P1_total = self.player_1.point_tally()
-        P2_total = self.player_2.point_tally()
-        P3_total = self.player_3.point_tally()
-
-        if max(P1_total, P2_total, -P3_total) == P1_total:
-            tally[0] += 1
+        # Monte Carlo learns once the game is over, from the reward of the last 
+        # move of the agent, which is its final score
+        if not online and last_state is not None:
+            agent.update_index(last_state, last_action)
             
-        elif max(P1_total, P2_total, -P3_total) == P2_total:
-            tally[1] += 1
-         
-        elif max(P1_total, P2_total, -P3_total) == -P3_total:
-            tally[2] += 1
+        hand_score = self.config.hand_score
+        scores = [hand_score(hands[i]) + chips[i] for i in range(self.n_players)]
+        
+        if online:
+            agent.agent_end(scores[agent_seat])
+        result = GameResult(scores, scores.index(max(scores)), self.turns, chips[:], hands[:])
+        
+        if tracer.level <= INFO:
+            tracer.emit(INFO, "result", scores = scores, winner = result.winner, turns = result.turns)
+        tracer.end_game()
+        
+        return result
          
-def Tournament(player_1, player_2, player_3, match_no, algo, agent_info):
-    
-    global agent, algorithm, tally
+def stop_below(tolerance, report = False):
+    """
+    Returns an on_batch hook for MonteCarloAgent that reports convergence once 
+    the q-values change by less than tolerance over a batch of simulations.
+    """
     
-    tally = [0,0,0]
+    def on_batch(simulations, delta_norm):
+        if report:
+            print(f'{simulations} simulations: q-values changed by {delta_norm:.4f}')
+            
+        return delta_norm < tolerance
     
-    algorithm = algo
+    return on_batch
+
+def new_agent(algo, agent_info):
+    """
+    Creates and initialises the agent for the given algorithm.
+    """
     
     if algo == "q-learning":
         agent = QLearningAgent()
+    elif algo == "linear":
+        agent = LinearAgent()
     else:
         agent = MonteCarloAgent()
         
     agent.agent_init(agent_info)
     
-    for i in range(1, match_no+1):
-        Game(player_1, player_2, player_3)
+    return agent
+    
+def Tournament(player_1, player_2, player_3, match_no, algo, agent_info, workers = 1, results = None, shared = False, **parallel_info):
+    """
+    Trains an agent in the seat of player_3 over match_no games against two 
+    random players and returns how often each player has won. With more than 
+    one worker the games are played by parallel_tournament(), or with shared 
+    by shared_tournament(), which take the extra keyword arguments and need a 
+    tabular agent.
+    
+    If agent_info has a "model_path", the table is saved there at the end. 
+    With "new_model" set to False the agent resumes from that checkpoint 
+    instead of starting from zeros. A GameConfig under "config" sets the 
+    game, the other players then play at random as well.
+    
+    With results, the record of every game is streamed to that directory, 
+    see ResultWriter and load_results().
+    """
+    
+    n_players = (agent_info.get("config") or GameConfig()).players
+    writer = ResultWriter(results, n_players) if results is not None else None
+    
+    if workers > 1 and shared:
+        if writer is not None:
+            raise ValueError("Results are not recorded in shared tournaments.")
+        tally, q = shared_tournament(match_no, algo, agent_info, workers, **parallel_info)
+    elif workers > 1:
+        tally, q = parallel_tournament(match_no, algo, agent_info, workers, writer = writer, **parallel_info)
+    else:
+        agent = new_agent(algo, agent_info)
+        game = GameEngine(agent, algo, tracer = agent.tracer, config = agent.config)
+        tally = [0] * game.n_players
+        
+        for i in range(1, match_no+1):
+            result = game.play()
+            tally[result.winner] += 1
+            
+            if writer is not None:
+                writer.write(result)
+            
+            if agent.converged:
+                break
+            
+        q = agent.q
+        
+    if writer is not None:
+        writer.close()
+        
+    if "model_path" in agent_info:
+        q.save(agent_info["model_path"])
                 
     print(tally)
+    
+    return tally
              
-agent_init_info = {"epsilon":0.2, "step_size":0.2, "new_model":True}
+# 5. Parallel Tournament
+# ----------------------------------------------------------------------------
+
+def play_shard(algo, agent_info, snapshot, games, seed, policies = None, record = False):
+    """
+    Plays a share of the games of a parallel tournament in a worker process. 
+    The agent starts from the merged table in snapshot and uses its own 
+    random generator seeded with seed, as does its replay sampling. The other seats are played by policies, 
+    see GameEngine. Returns the tally together with the change of each row of 
+    the table: (tally, (index, value delta, visit delta)). Rows that are new 
+    to the snapshot change from their init values. With record, the 
+    records of the games follow as a third item, see ResultBuffer.
+    """
+    
+    random.seed(seed)
+    
+    agent = new_agent(algo, dict(agent_info, new_model = True, seed = seed))
+    agent.q = SparseQTable.from_snapshot(agent.actions, snapshot, agent.q.init)
+    game = GameEngine(agent, algo, policies, config = agent.config)
+    buffer = ResultBuffer(game.n_players, games) if record else None
+    
+    tally = [0] * game.n_players
+    for i in range(games):
+        result = game.play()
+        tally[result.winner] += 1
+        
+        if record:
+            buffer.append(result)
+        
+    index, values, visits = agent.q.snapshot()
+    n = len(snapshot[0])
+    values[:n] -= snapshot[1]
+    visits[:n] -= snapshot[2]
+    
+    # merge_deltas() starts new rows at init again, so only their change counts
+    if agent.q.init is not None:
+        for row, state in enumerate(index[n:].tolist(), n):
+            values[row] -= agent.q.init(state)
+    
+    if record:
+        return tally, (index, values, visits), buffer.view()
+    
+    return tally, (index, values, visits)
+
+def merge_deltas(q, deltas, merge = "average"):
+    """
+    Adds the table changes of several workers to q. The visit counts are 
+    summed. The values are combined either by:
+        
+        "average"  -> mean of the value changes of all workers
+        "weighted" -> mean weighted by how often each worker visited the 
+                      state-action pair in this round
+    """
+    
+    rows = [q.rows_for(index) for index, values, visits in deltas]
+    
+    if merge == "weighted":
+        total = np.zeros(q.values.shape)
+        weight = np.zeros(q.visits.shape)
+        
+        for row, (index, values, visits) in zip(rows, deltas):
+            total[row] += values * visits
+            weight[row] += visits
             
-Tournament('Alice', 'Bob', 'Charlie', 10000, "monte-carlo", agent_init_info)
+        np.divide(total, weight, out = total, where = weight > 0)
+        q.values += total
+    
+    elif merge == "average":
+        for row, (index, values, visits) in zip(rows, deltas):
+            q.values[row] += values / len(deltas)
+    
+    else:
+        raise ValueError(f'Unknown merge "{merge}", use "average" or "weighted".')
             
+    for row, (index, values, visits) in zip(rows, deltas):
+        q.visits[row] += visits
+
+def worker_info(agent_info):
+    """
+    Returns agent_info for the agents of worker processes. Tracers and hooks 
+    stay in the main process, the workers play untraced.
+    """
+    
+    return dict(agent_info, tracer = null_tracer, on_batch = None)
+
+def play_round(pool, algo, agent_info, q, games, workers, seed, policies = None, merge = "average", record = False):
+    """
+    Plays one round of games on the worker processes of pool. The games are 
+    split into min(workers, games) shares that all start from a snapshot of 
+    the table q, share i with the seed seed + i, see play_shard(). Their 
+    changes are merged into q with merge_deltas().
+    
+    Returns the tally of the round and, with record, the records of every 
+    share in order, see ResultBuffer.
+    """
+    
+    shares = [games // workers + (i < games % workers) for i in range(min(workers, games))]
+    snapshot = q.snapshot()
+    
+    futures = [pool.submit(play_shard, algo, agent_info, snapshot, share, seed + i, policies, record) 
+               for i, share in enumerate(shares)]
+    results = [future.result() for future in futures]
+    
+    merge_deltas(q, [result[1] for result in results], merge)
+    tally = np.sum([result[0] for result in results], axis = 0).tolist()
+    
+    return tally, [result[2] for result in results] if record else []
+
+def parallel_tournament(match_no, algo, agent_info, workers, sync_every = 1000, merge = "average", seed = 0, writer = None):
+    """
+    Plays a tournament on a pool of worker processes. Games are played in 
+    rounds: each worker plays up to sync_every games against its own copy of 
+    the table, then the changes of all workers are merged with merge_deltas() 
+    and the next round starts from the merged table. Every shard gets its own 
+    seed, derived from seed, so runs can be repeated. With a ResultWriter as 
+    writer, the workers record their games and the records are written in 
+    the order of the shards.
+    
+    Returns the tally over all games and the merged SparseQTable. Tabular 
+    agents only.
+    """
+    
+    agent_info = worker_info(agent_info)
+    agent = new_agent(algo, agent_info)
+    if isinstance(agent.q, LinearQ):
+        raise ValueError(f'Parallel tournaments need a tabular agent, not "{algo}".')
+    
+    q = agent.q
+    tally = [0] * agent.config.players
+    played = 0
+    shard = 0
+    
+    with ProcessPoolExecutor(max_workers = workers) as pool:
+        while played < match_no:
+            games = min(workers * sync_every, match_no - played)
+            round_tally, records = play_round(pool, algo, agent_info, q, games, workers, seed + shard, 
+                                              merge = merge, record = writer is not None)
+            tally = [i + j for i, j in zip(tally, round_tally)]
             
+            for shard_records in records:
+                writer.extend(shard_records)
+                
+            shard += min(workers, games)
+            played += games
             
+    return tally, q
+             
+def shared_worker(algo, agent_info, games, seed, tallies, worker):
+    """
+    Plays games in a worker process of shared_tournament() and adds its wins 
+    per seat to its slice of the shared tallies.
+    """
+    
+    random.seed(seed)
+    
+    agent = new_agent(algo, dict(agent_info, seed = seed))
+    game = GameEngine(agent, algo, config = agent.config)
+    
+    tally = [0] * game.n_players
+    for i in range(games):
+        tally[game.play().winner] += 1
+        
+    tallies[worker * game.n_players:(worker + 1) * game.n_players] = tally
+    agent.q.close()
+    
+def shared_tournament(match_no, algo, agent_info, workers, locks = 0, seed = 0):
+    """
+    Plays a tournament on worker processes that all learn in the same 
+    SharedQTable at once, without rounds or merging. locks stripes of locks 
+    guard the updates, with 0 (default) the workers update Hogwild-style. 
+    Each worker gets its own seed, derived from seed.
+    
+    Returns the tally over all games and the visited rows of the table as a 
+    SparseQTable. Tabular agents only. Raises a RuntimeError if a worker 
+    fails.
+    """
+    
+    agent_info = worker_info(agent_info)
+    agent = new_agent(algo, agent_info)
+    if isinstance(agent.q, LinearQ):
+        raise ValueError(f'Shared tournaments need a tabular agent, not "{algo}".')
+    
+    # Start where the agent would start: from the checkpoint, or from the 
+    # rewards for agents that initialize new rows with them
+    values = None
+    if not agent_info.get("new_model", True):
+        values = np.zeros((len(agent.abstraction), len(agent.actions)))
+        n = len(agent.q)
+        values[agent.q.index[:n]] = agent.q.values[:n]
+    elif getattr(agent.q, "init", None) is not None:
+        values = agent.R.values
+        
+    q = SharedQTable.create(len(agent.abstraction), agent.actions, values, locks)
+    n_players = agent.config.players
+    tallies = multiprocessing.Array("q", workers * n_players, lock = False)
+    
+    try:
+        shared_info = dict(agent_info, shared_table = q.name, locks = q.locks)
+        processes = []
+        for i in range(workers):
+            games = match_no // workers + (i < match_no % workers)
+            processes.append(multiprocessing.Process(target = shared_worker, 
+                                                     args = (algo, shared_info, games, seed + i, tallies, i)))
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
             
+        failed = [i for i, process in enumerate(processes) if process.exitcode != 0]
+        if failed:
+            raise RuntimeError(f'Workers {failed} of the shared tournament failed.')
             
-            
\ No newline at end of file
+        tally = np.array(tallies[:]).reshape(workers, n_players).sum(axis = 0).tolist()
+        table = q.to_sparse()
+    finally:
+        q.close()
+        
+    return tally, table
+             
+agent_init_info = {"epsilon":0.2, "step_size":0.2, "new_model":True}
+
+if __name__ == "__main__":
+    Tournament('Alice', 'Bob', 'Charlie', 10000, "monte-carlo", agent_init_info)